@@ -0,0 +1,194 @@
+# 逐時測項的向量化統計：滑動平均、PM2.5 / PM10 移動平均與 AQI 副指標
+# 每個測項以累積和陣列保存，新的小時資料到達時只計算新增的時間點
+import numpy as np
+from threading import Lock
+
+from history import POLLUTANTS
+
+HOUR = 3600
+
+# 滑動平均視窗(小時)與所需最少有效筆數
+WINDOWS = {4: 2, 8: 6, 12: 6, 24: 16}
+STAT_NAMES = ('value', 'mean_8h', 'mean_12h', 'mean_24h', 'moving_avg', 'sub_index')
+
+# AQI 副指標斷點：(濃度下限, 濃度上限, 指標下限, 指標上限)
+BREAKPOINTS = {
+    'PM2.5': [(0.0, 15.4, 0, 50), (15.5, 35.4, 51, 100), (35.5, 54.4, 101, 150), (54.5, 150.4, 151, 200),
+              (150.5, 250.4, 201, 300), (250.5, 350.4, 301, 400), (350.5, 500.4, 401, 500)],
+    'PM10': [(0, 54, 0, 50), (55, 125, 51, 100), (126, 254, 101, 150), (255, 354, 151, 200),
+             (355, 424, 201, 300), (425, 504, 301, 400), (505, 604, 401, 500)],
+    'Ozone': [(0, 54, 0, 50), (55, 70, 51, 100), (71, 85, 101, 150), (86, 105, 151, 200), (106, 200, 201, 300)],
+    'CO': [(0.0, 4.4, 0, 50), (4.5, 9.4, 51, 100), (9.5, 12.4, 101, 150), (12.5, 15.4, 151, 200),
+           (15.5, 30.4, 201, 300), (30.5, 40.4, 301, 400), (40.5, 50.4, 401, 500)],
+    'SO2': [(0, 20, 0, 50), (21, 75, 51, 100), (76, 185, 101, 150), (186, 304, 151, 200)],
+    'NO2': [(0, 30, 0, 50), (31, 100, 51, 100), (101, 360, 101, 150), (361, 649, 151, 200),
+            (650, 1249, 201, 300), (1250, 1649, 301, 400), (1650, 2049, 401, 500)],
+}
+# 臭氧小時值達 125 ppb 以上時另以小時值斷點計算，取兩者較大值；8 小時平均超過 200 ppb 時只以小時值計算
+OZONE_1H_BREAKPOINTS = [(125, 164, 101, 150), (165, 204, 151, 200), (205, 404, 201, 300),
+                        (405, 504, 301, 400), (505, 604, 401, 500)]
+# 二氧化硫小時值超過 304 ppb 時改以 24 小時平均值計算
+SO2_24H_BREAKPOINTS = [(305, 604, 201, 300), (605, 804, 301, 400), (805, 1004, 401, 500)]
+# 計算副指標前濃度取到的小數位數
+DECIMALS = {'PM2.5': 1, 'PM10': 0, 'Ozone': 0, 'CO': 1, 'SO2': 0, 'NO2': 0}
+
+
+def sub_index(concentrations, breakpoints, decimals=0):
+    """依斷點表以線性內插計算副指標；缺值或超出斷點表範圍(無定義)時為 NaN"""
+    scale = 10 ** decimals
+    # 先四捨五入到 6 位避免浮點誤差(例如 15.4 存成 15.3999996)後再無條件捨去
+    c = np.floor(np.round(np.asarray(concentrations, dtype=float) * scale, 6)) / scale
+    table = np.asarray(breakpoints, dtype=float)
+    index = np.searchsorted(table[:, 1], c, side='left')
+    c_lo, c_hi, i_lo, i_hi = table[np.minimum(index, len(table) - 1)].T
+    result = (i_hi - i_lo) / (c_hi - c_lo) * (np.maximum(c, c_lo) - c_lo) + i_lo
+    outside = np.isnan(c) | (c < table[0, 0]) | (index >= len(table))
+    return np.where(outside, np.nan, np.round(result))
+
+
+class GrowableArray:
+    """容量不足時加倍的一維陣列"""
+
+    def __init__(self, capacity=256):
+        self.data = np.full(capacity, np.nan)
+        self.size = 0
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self.data):
+            data = np.full(max(end, len(self.data) * 2), np.nan)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:end] = values
+        self.size = end
+
+    def view(self):
+        return self.data[:self.size]
+
+
+class PollutantSeries:
+    """單一測項從 start 起的逐時資料(缺的小時為 NaN)與各項統計"""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+        self.stats = {stat: GrowableArray() for stat in STAT_NAMES}
+        # 累積和與累積有效筆數，第一個元素為 0
+        self.cumsum = GrowableArray()
+        self.cumcount = GrowableArray()
+        self.cumsum.extend([0.0])
+        self.cumcount.extend([0.0])
+
+    @property
+    def last_time(self):
+        size = self.stats['value'].size
+        return None if self.start is None or size == 0 else self.start + (size - 1) * HOUR
+
+    def rolling_mean(self, end, window):
+        """以累積和計算截至 end(含)的 window 小時平均，有效筆數不足時為 NaN"""
+        begin = np.maximum(end + 1 - window, 0)
+        total = self.cumsum.view()[end + 1] - self.cumsum.view()[begin]
+        count = self.cumcount.view()[end + 1] - self.cumcount.view()[begin]
+        return np.where(count >= WINDOWS[window], total / np.maximum(count, 1), np.nan)
+
+    def append(self, times, values):
+        """附加新的小時資料(時間需比已有資料新)，只計算新增時間點的統計"""
+        times = np.asarray(times, dtype=np.int64)
+        if self.start is None:
+            self.start = int(times[0])
+        old_size = self.stats['value'].size
+        index = (times - self.start) // HOUR
+        new_size = int(index[-1]) + 1
+        hourly = np.full(new_size - old_size, np.nan)
+        hourly[index - old_size] = values
+
+        valid = ~np.isnan(hourly)
+        self.cumsum.extend(self.cumsum.view()[-1] + np.cumsum(np.where(valid, hourly, 0.0)))
+        self.cumcount.extend(self.cumcount.view()[-1] + np.cumsum(valid))
+
+        end = np.arange(old_size, new_size)
+        means = {window: self.rolling_mean(end, window) for window in WINDOWS}
+        self.stats['value'].extend(hourly)
+        for window in (8, 12, 24):
+            self.stats[f'mean_{window}h'].extend(means[window])
+
+        # 移動平均 = 0.5 × 前12小時平均 + 0.5 × 前4小時平均(前4小時不足時以前12小時平均代入)
+        if self.name in ('PM2.5', 'PM10'):
+            moving = 0.5 * means[12] + 0.5 * np.where(np.isnan(means[4]), means[12], means[4])
+        else:
+            moving = np.full(len(end), np.nan)
+        self.stats['moving_avg'].extend(moving)
+
+        breakpoints, decimals = BREAKPOINTS[self.name], DECIMALS[self.name]
+        if self.name in ('PM2.5', 'PM10'):
+            index_values = sub_index(moving, breakpoints, decimals)
+        elif self.name == 'Ozone':
+            index_values = np.fmax(
+                sub_index(means[8], breakpoints, decimals),
+                sub_index(np.where(hourly >= 125, hourly, np.nan), OZONE_1H_BREAKPOINTS, decimals)
+            )
+        elif self.name == 'CO':
+            index_values = sub_index(means[8], breakpoints, decimals)
+        elif self.name == 'SO2':
+            index_values = np.where(
+                hourly >= SO2_24H_BREAKPOINTS[0][0],
+                sub_index(means[24], SO2_24H_BREAKPOINTS, decimals),
+                sub_index(hourly, breakpoints, decimals)
+            )
+        else:
+            index_values = sub_index(hourly, breakpoints, decimals)
+        self.stats['sub_index'].extend(index_values)
+
+    def series(self, since):
+        """回傳 since(epoch 秒)之後的時間陣列與各項統計陣列"""
+        size = self.stats['value'].size
+        if self.start is None or size == 0:
+            return np.empty(0, dtype=np.int64), {stat: np.empty(0) for stat in STAT_NAMES}
+        begin = min(max((since - self.start + HOUR - 1) // HOUR, 0), size)
+        times = self.start + np.arange(begin, size, dtype=np.int64) * HOUR
+        return times, {stat: array.view()[begin:] for stat, array in self.stats.items()}
+
+    def at(self, timestamp):
+        """指定整點的各項統計，超出範圍時回傳 None"""
+        if self.start is None or timestamp < self.start or (timestamp - self.start) % HOUR:
+            return None
+        index = (timestamp - self.start) // HOUR
+        if index >= self.stats['value'].size:
+            return None
+        return {stat: array.view()[index] for stat, array in self.stats.items()}
+
+
+class HourlyAnalytics:
+    """從 HourlyHistory 增量讀取新資料，維護各測項的統計"""
+
+    def __init__(self, history):
+        self.history = history
+        self.lock = Lock()
+        self.series = {name: PollutantSeries(name) for name in POLLUTANTS}
+
+    def update(self):
+        with self.lock:
+            for name, series in self.series.items():
+                last = series.last_time
+                times, values = self.history.query(name, 0 if last is None else last + 1)
+                if len(times):
+                    # 檔案中以 float32 儲存，轉回 float64 並去掉單精度的尾數誤差
+                    values = np.round(np.frombuffer(values, dtype=np.float32).astype(float), 4)
+                    series.append(np.frombuffer(times, dtype=np.int64), values)
+
+    def latest(self):
+        """最新整點各測項的統計與 AQI(各副指標最大值)"""
+        with self.lock:
+            latest_time = max((s.last_time for s in self.series.values() if s.last_time is not None), default=None)
+            if latest_time is None:
+                return None, None, {}
+            stats = {name: series.at(latest_time) for name, series in self.series.items()}
+            stats = {name: values for name, values in stats.items() if values is not None}
+            indices = [values['sub_index'] for values in stats.values() if not np.isnan(values['sub_index'])]
+            aqi = max(indices) if indices else np.nan
+            return latest_time, aqi, stats
+
+    def query(self, name, since):
+        with self.lock:
+            times, stats = self.series[name].series(since)
+            return times.copy(), {stat: values.copy() for stat, values in stats.items()}
@@ -1,50 +1,619 @@
-from flask import Flask, render_template_string, send_from_directory
+from flask import Flask, Response, g, request, render_template_string
+from flask.json.provider import DefaultJSONProvider
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta, timezone
-from threading import Lock
+from threading import Lock, Thread, Condition, local
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace, asdict
+from types import MappingProxyType
 import urllib3
 import os
 import json
+import time
+import sqlite3
+import socket
+import tempfile
+import atexit
+import gzip
+import hashlib
+import io
+import math
+import mimetypes
+import shutil
+from urllib.parse import urlencode, urlsplit
+try:
+    import ijson
+except ImportError:
+    ijson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+try:
+    from gevent import get_hub, monkey
+except ImportError:
+    monkey = None
+from analytics import HourlyAnalytics, STAT_NAMES
+from forecast import ForecastTimeline, build_columns, FIELD_NAMES
+from history import HourlyHistory, POLLUTANTS
+from models import Record, SiteReading, ForecastReading, MEASUREMENTS, to_float
+from metrics import Counter, Gauge, Histogram, render as render_metrics
+from logs import setup_logging
+
+# 記錄等級：預設只記錄警告與錯誤，需要觀察每次更新的細節時設為 INFO 或 DEBUG
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING').upper()
+logger = setup_logging('toufen', LOG_LEVEL)
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)
+
+# 快照內容為唯讀型別，序列化時轉回一般 dict
+def json_default(o):
+    if isinstance(o, MappingProxyType):
+        return dict(o)
+    return DefaultJSONProvider.default(o)
+
+app.json.default = json_default
 TAIPEI_TZ = timezone(timedelta(hours=8))
 BACKGROUND_IMAGE = "background.jpg"
 
-# 空氣品質數據(右側 - 保留原樣)
-latest_data = {
+# 首頁與 /api/data 未指定測站時顯示的測站
+DEFAULT_SITE = '頭份'
+
+# 空氣品質數據(右側 - 保留原樣)：單一測站尚未取得資料時頁面顯示的內容
+EMPTY_AQI_DATA = {
     'aqi': 'N/A', 'pm25_avg': 'N/A', 'pm10_avg': 'N/A',
     'pm10': 'N/A', 'pm25': 'N/A', 'o3': 'N/A',
-    'update_time': '尚未更新', 'site_name': '頭份',
-    'publish_time': 'N/A', 'has_data': False, 'last_fetch': None
+    'update_time': '尚未更新', 'site_name': DEFAULT_SITE,
+    'publish_time': 'N/A', 'has_data': False
 }
 
-# 天氣預報數據(左側 - 修改為預報)
-forecast_data = {
+# 空品數據源：一次下載全部測站，依測站名稱(SiteReading)與縣市建立索引
+EMPTY_AQI_SOURCE = {
+    'sites': {},
+    'counties': {},
+    'last_fetch': None
+}
+
+# 首頁與 /api/data 未指定鄉鎮時顯示的預報地點
+DEFAULT_LOCATION = '頭份市'
+
+# 天氣預報數據(左側 - 修改為預報)：單一鄉鎮尚未取得資料時頁面顯示的內容
+EMPTY_FORECAST_DATA = {
+    'location_name': DEFAULT_LOCATION,
     'temp': 'N/A', 'feels_like': 'N/A',
     'comfort_index': 'N/A', 'comfort_desc': '無資料',
     'comfort_emoji': '❓', 'comfort_color': 'gray',
     'humidity': 'N/A', 'wind_display': 'N/A',
     'weather_desc': 'N/A', 'pop': 'N/A',
     'forecast_time': 'N/A',
-    'has_data': False, 'last_fetch': None
+    'has_data': False
+}
+
+# 預報數據源：一次下載全縣預報，依鄉鎮名稱建立索引(下一整點的 ForecastReading 與欄式時間軸)
+EMPTY_FORECAST_SOURCE = {
+    'locations': {},
+    'timelines': {},
+    'last_fetch': None
 }
 
 # 天氣警特報數據
-alert_data = {
+EMPTY_ALERT_DATA = {
     'has_alert': False,
     'alerts': [],
     'last_fetch': None
 }
 
+# 更新鎖：同一時間只允許一個更新(single-flight)，讀取端不使用任何鎖
 fetch_lock = Lock()
 
-AQI_API_URL = "https://data.moenv.gov.tw/api/v2/aqx_p_432?format=json&api_key=e0438a06-74df-4300-8ce5-edfcb08c82b8&filters=SiteName,EQ,頭份"
-AQI_HOURLY_API_URL = "https://data.moenv.gov.tw/api/v2/aqx_p_213?language=en&limit=12&api_key=e0438a06-74df-4300-8ce5-edfcb08c82b8"
-FORECAST_API_URL = "https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-013?Authorization=CWA-BC6838CC-5D26-43CD-B524-8A522B534959&LocationName=頭份市"
+# 背景更新排程(秒)：檢查間隔，實際是否更新由 should_fetch_data() 判斷
+# 非更新者的 worker 也以此間隔檢查共用快照是否有新版本
+REFRESH_CHECK_SECONDS = int(os.environ.get('REFRESH_CHECK_SECONDS', 5))
+refresher_lock = Lock()
+refresher_thread = None
+
+# 啟動模式：預設立即開始服務(先提供共用快照或預設內容)，首次更新在背景執行
+# BLOCKING_STARTUP=1 時沿用舊行為，啟動時先同步抓取上游數據
+BLOCKING_STARTUP = os.environ.get('BLOCKING_STARTUP', '0') == '1'
+
+# 並行抓取模式：所有上游請求同時送出，更新時間約等於最慢的單一請求
+# 執行緒數需大於「三個數據源 + AQI 內部兩個請求」，避免巢狀提交時互相等待
+CONCURRENT_FETCH = os.environ.get('CONCURRENT_FETCH', '1') != '0'
+fetch_executor = ThreadPoolExecutor(max_workers=6, thread_name_prefix='fetch')
+
+# 各數據源獨立快取：TTL(秒)可用環境變數個別設定，只更新已過期的數據源
+# 空品為每小時資料、預報每日更新數次、警特報需要較即時
+SOURCE_TTLS = {
+    'aqi': int(os.environ.get('AQI_TTL_SECONDS', 600)),
+    'forecast': int(os.environ.get('FORECAST_TTL_SECONDS', 3600)),
+    'alert': int(os.environ.get('ALERT_TTL_SECONDS', 180)),
+}
+# 抓取失敗後的重試間隔(秒)
+SOURCE_RETRY_SECONDS = int(os.environ.get('SOURCE_RETRY_SECONDS', 60))
+
+# 每個數據源的更新狀態：TTL、最後嘗試時間(最後成功時間與版本號記錄在快照中)
+source_cache = {
+    name: {'ttl': ttl, 'last_attempt': None}
+    for name, ttl in SOURCE_TTLS.items()
+}
+
+def freeze(value):
+    """將 dict / list 轉為唯讀的 MappingProxyType / tuple"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+@dataclass(frozen=True)
+class DataSnapshot:
+    """不可變的數據快照：更新時在旁建立新快照，再以單一參考替換發布"""
+    version: int
+    aqi: MappingProxyType
+    forecast: MappingProxyType
+    alert: MappingProxyType
+    # 各數據源最後成功時間與版本號
+    fetched_at: MappingProxyType
+    source_versions: MappingProxyType
+
+current_snapshot = DataSnapshot(
+    version=0,
+    aqi=freeze(EMPTY_AQI_SOURCE),
+    forecast=freeze(EMPTY_FORECAST_SOURCE),
+    alert=freeze(EMPTY_ALERT_DATA),
+    fetched_at=MappingProxyType({name: None for name in SOURCE_TTLS}),
+    source_versions=MappingProxyType({name: 0 for name in SOURCE_TTLS}),
+)
+# 發布鎖只給寫入端使用(多個數據源可能同時完成)，讀取端直接讀取 current_snapshot
+publish_lock = Lock()
+# 快照替換後通知等待中的推送連線
+snapshot_changed = Condition()
+
+def notify_snapshot_listeners():
+    with snapshot_changed:
+        snapshot_changed.notify_all()
+
+def without_fetch_times(data):
+    """去掉每次抓取都會變的時間(last_fetch 與各測站的 update_time)，只留下上游內容"""
+    content = {k: v for k, v in data.items() if k != 'last_fetch'}
+    if 'sites' in content:
+        content['sites'] = {site: replace(reading, update_time=None) for site, reading in content['sites'].items()}
+    return content
+
+def publish_source(name, data, fetched_at_time=None):
+    """以新數據建立新快照並原子替換，舊快照保持不變
+    fetched_at_time 用於還原磁碟快照時保留原本的抓取時間
+    上游內容與目前快照相同時(例如條件式請求收到 304)只更新抓取時間，不遞增版本也不通知推送連線，
+    頁面、API 的 ETag 與快取都維持不變"""
+    global current_snapshot
+    data = freeze(data)
+    with publish_lock:
+        snapshot = current_snapshot
+        fetched_at = dict(snapshot.fetched_at)
+        fetched_at[name] = fetched_at_time or get_taipei_time()
+        unchanged = without_fetch_times(data) == without_fetch_times(getattr(snapshot, name))
+        if unchanged:
+            current_snapshot = replace(snapshot, fetched_at=MappingProxyType(fetched_at))
+        else:
+            source_versions = dict(snapshot.source_versions)
+            source_versions[name] += 1
+            current_snapshot = replace(
+                snapshot,
+                version=snapshot.version + 1,
+                fetched_at=MappingProxyType(fetched_at),
+                source_versions=MappingProxyType(source_versions),
+                **{name: data}
+            )
+        save_shared_snapshot(current_snapshot, content_changed=not unchanged)
+        save_persisted_snapshot(current_snapshot)
+    if not unchanged:
+        notify_snapshot_listeners()
+
+# 跨 worker 共用快照：gunicorn 的多個 worker 讀寫同一個 SQLite 檔案
+# 只有取得更新租約的 worker 會呼叫上游 API，其他 worker 只讀取共用快照
+# SHARED_STORE_PATH 設為空字串時停用(每個行程各自更新)
+SHARED_STORE_PATH = os.environ.get('SHARED_STORE_PATH', os.path.join(tempfile.gettempdir(), 'toufen-air-quality.sqlite3'))
+# 租約在背景檢查之間、每個數據源開始前與每頁小時值前續約，單次上游請求(逾時 10 秒)遠短於租約時間
+REFRESHER_LEASE_SECONDS = int(os.environ.get('REFRESHER_LEASE_SECONDS', 90))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+store_local = local()
+
+def get_store_connection():
+    """每個執行緒各自使用一個 SQLite 連線"""
+    conn = getattr(store_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(SHARED_STORE_PATH, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS snapshot (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL, payload TEXT NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS snapshot_fetched_at (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL, fetched_at TEXT NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS refresher_lease (id INTEGER PRIMARY KEY CHECK (id = 1), owner TEXT NOT NULL, expires_at REAL NOT NULL)')
+        store_local.conn = conn
+    return conn
+
+# 快照序列化格式版本，紀錄欄位變更時遞增；版本不符的共用 / 磁碟快照不載入
+SNAPSHOT_FORMAT = 2
+
+def snapshot_to_json(snapshot):
+    def default(o):
+        if isinstance(o, MappingProxyType):
+            return dict(o)
+        if isinstance(o, Record):
+            return o.to_row()
+        if isinstance(o, datetime):
+            return o.isoformat()
+        raise TypeError(f"無法序列化 {type(o).__name__}")
+    return json.dumps({
+        'format': SNAPSHOT_FORMAT,
+        'version': snapshot.version,
+        'aqi': snapshot.aqi,
+        'forecast': snapshot.forecast,
+        'alert': snapshot.alert,
+        'fetched_at': snapshot.fetched_at,
+        'source_versions': snapshot.source_versions,
+    }, default=default, ensure_ascii=False, separators=(',', ':'))
+
+# 以索引保存紀錄的數據源：數據源名稱 → (索引欄位, 紀錄型別)
+SOURCE_INDEXES = {'aqi': ('sites', SiteReading), 'forecast': ('locations', ForecastReading)}
+
+def snapshot_from_json(text):
+    def parse_time(value):
+        return datetime.fromisoformat(value) if value else None
+    payload = json.loads(text)
+    if payload.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"快照格式 {payload.get('format')} 與目前版本 {SNAPSHOT_FORMAT} 不符")
+    sources = {}
+    for name in SOURCE_TTLS:
+        data = payload[name]
+        data['last_fetch'] = parse_time(data.get('last_fetch'))
+        if name in SOURCE_INDEXES:
+            index, record_type = SOURCE_INDEXES[name]
+            data[index] = {key: record_type.from_row(row) for key, row in data[index].items()}
+        sources[name] = freeze(data)
+    return DataSnapshot(
+        version=payload['version'],
+        fetched_at=MappingProxyType({name: parse_time(payload['fetched_at'].get(name)) for name in SOURCE_TTLS}),
+        source_versions=MappingProxyType({name: payload['source_versions'].get(name, 0) for name in SOURCE_TTLS}),
+        **sources
+    )
+
+def save_shared_snapshot(snapshot, content_changed=True):
+    """寫入共用快照；內容未變(版本相同)時只寫入各數據源的抓取時間"""
+    if not SHARED_STORE_PATH:
+        return
+    try:
+        conn = get_store_connection()
+        if content_changed:
+            conn.execute(
+                'INSERT OR REPLACE INTO snapshot (id, version, payload) VALUES (1, ?, ?)',
+                (snapshot.version, snapshot_to_json(snapshot))
+            )
+        conn.execute(
+            'INSERT OR REPLACE INTO snapshot_fetched_at (id, version, fetched_at) VALUES (1, ?, ?)',
+            (snapshot.version, json.dumps({name: t.isoformat() if t else None for name, t in snapshot.fetched_at.items()}))
+        )
+    except sqlite3.Error as e:
+        logger.warning('寫入共用快照失敗', extra={'error': str(e)})
+
+def sync_shared_fetched_at(conn):
+    """共用快照版本與目前相同時，同步其他 worker 更新的抓取時間(上游內容未變的更新)"""
+    global current_snapshot
+    version = current_snapshot.version
+    row = conn.execute(
+        'SELECT fetched_at FROM snapshot_fetched_at WHERE id = 1 AND version = ?', (version,)
+    ).fetchone()
+    if row is None:
+        return
+    fetched_at = dict(current_snapshot.fetched_at)
+    fetched_at.update({
+        name: datetime.fromisoformat(value) if value else None
+        for name, value in json.loads(row[0]).items() if name in fetched_at
+    })
+    with publish_lock:
+        if current_snapshot.version == version and fetched_at != dict(current_snapshot.fetched_at):
+            current_snapshot = replace(current_snapshot, fetched_at=MappingProxyType(fetched_at))
+
+def sync_from_shared_store():
+    """共用快照版本較新時載入並替換目前快照"""
+    global current_snapshot
+    if not SHARED_STORE_PATH:
+        return False
+    try:
+        conn = get_store_connection()
+        row = conn.execute(
+            'SELECT payload FROM snapshot WHERE id = 1 AND version > ?', (current_snapshot.version,)
+        ).fetchone()
+        if row is None:
+            sync_shared_fetched_at(conn)
+            return False
+        snapshot = snapshot_from_json(row[0])
+    except (sqlite3.Error, ValueError, KeyError, TypeError) as e:
+        logger.warning('讀取共用快照失敗', extra={'error': str(e)})
+        return False
+    with publish_lock:
+        if snapshot.version > current_snapshot.version:
+            current_snapshot = snapshot
+    notify_snapshot_listeners()
+    return True
+
+def acquire_refresher_lease():
+    """取得或續約更新租約；同一時間只有一個 worker 擁有租約"""
+    if not SHARED_STORE_PATH:
+        return True
+    now = time.time()
+    try:
+        conn = get_store_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT owner, expires_at FROM refresher_lease WHERE id = 1').fetchone()
+            if row is None or row[0] == WORKER_ID or row[1] < now:
+                conn.execute(
+                    'INSERT OR REPLACE INTO refresher_lease (id, owner, expires_at) VALUES (1, ?, ?)',
+                    (WORKER_ID, now + REFRESHER_LEASE_SECONDS)
+                )
+                acquired = True
+            else:
+                acquired = False
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
+        return acquired
+    except sqlite3.Error as e:
+        # 共用儲存無法使用時退回由本行程自行更新
+        logger.warning('取得更新租約失敗，改由本行程更新', extra={'error': str(e)})
+        return True
+
+# 磁碟快照：每次成功更新後以 gzip 壓縮 JSON 寫入，重新啟動或上游故障時仍可提供最近的數據
+# 先寫入暫存檔再 os.replace，確保檔案不會只寫一半；SNAPSHOT_FILE 設為空字串時停用
+SNAPSHOT_FILE = os.environ.get('SNAPSHOT_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot.json.gz'))
+
+def save_persisted_snapshot(snapshot):
+    if not SNAPSHOT_FILE:
+        return
+    directory = os.path.dirname(os.path.abspath(SNAPSHOT_FILE))
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(gzip.compress(snapshot_to_json(snapshot).encode('utf-8')))
+            os.replace(tmp_path, SNAPSHOT_FILE)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logger.warning('寫入磁碟快照失敗', extra={'error': str(e)})
+
+def load_persisted_snapshot():
+    if not SNAPSHOT_FILE or not os.path.exists(SNAPSHOT_FILE):
+        return None
+    try:
+        with open(SNAPSHOT_FILE, 'rb') as f:
+            return snapshot_from_json(gzip.decompress(f.read()).decode('utf-8'))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning('讀取磁碟快照失敗', extra={'error': str(e)})
+        return None
+
+def restore_persisted_snapshot():
+    """磁碟快照版本較新時採用(例如重新啟動後共用快照已被清除)"""
+    global current_snapshot
+    snapshot = load_persisted_snapshot()
+    if snapshot is None:
+        return False
+    with publish_lock:
+        if snapshot.version <= current_snapshot.version:
+            return False
+        current_snapshot = snapshot
+        save_shared_snapshot(snapshot)
+    notify_snapshot_listeners()
+    logger.info('已載入磁碟快照', extra={'version': snapshot.version})
+    return True
+
+# 逐時測項歷史：每次抓到的小時值都累積到本機檔案，供 /api/history 查詢
+HISTORY_FILE = os.environ.get('HISTORY_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.bin'))
+hourly_history = HourlyHistory(HISTORY_FILE)
+# 滑動平均、移動平均與副指標，新的小時資料進來時增量計算
+hourly_analytics = HourlyAnalytics(hourly_history)
+
+# 小時值增量抓取：由上游依測站與監測時間篩選，只取游標(最後一筆監測時間)之後的資料
+# 沒有歷史資料或停機太久時，最多回補 HOURLY_BACKFILL_HOURS 小時
+HOURLY_SITE_NAME = 'Toufen'
+HOURLY_BACKFILL_HOURS = int(os.environ.get('HOURLY_BACKFILL_HOURS', 168))
+HOURLY_PAGE_SIZE = 1000
+HOURLY_MAX_PAGES = 20
+
+def parse_monitor_time(value):
+    """將監測 / 發布時間轉為 epoch 秒(整點)，無法解析時回傳 None"""
+    for fmt in ('%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M:%S', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return int(datetime.strptime(value, fmt).replace(minute=0, second=0, tzinfo=TAIPEI_TZ).timestamp())
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def record_hourly_history(records):
+    """將小時值紀錄附加到歷史(其他測站與無法解析的數值略過)，回傳新增筆數"""
+    readings = []
+    for record in records:
+        if record.get('sitename') != HOURLY_SITE_NAME:
+            continue
+        timestamp = parse_monitor_time(record.get('monitordate'))
+        try:
+            readings.append((timestamp, record.get('itemname', ''), float(record.get('concentration'))))
+        except (TypeError, ValueError):
+            continue
+    return hourly_history.append_readings([r for r in readings if r[0] is not None])
+
+def ingest_hourly_history():
+    """從游標開始分頁抓取新的小時值並寫入歷史，回傳新增筆數；失敗時保留游標下次重試
+    上游的排序不保證由舊到新(預設為最新在前)，而歷史只接受比已儲存資料更新的時間點
+    因此所有分頁都取得後才一次排序寫入；中途失敗時整批捨棄，避免先寫入較新的分頁後留下永遠補不到的缺口"""
+    latest = hourly_history.latest_time()
+    earliest = int((get_taipei_time() - timedelta(hours=HOURLY_BACKFILL_HOURS)).timestamp())
+    cursor = datetime.fromtimestamp(max(latest or earliest, earliest), TAIPEI_TZ).strftime('%Y-%m-%d %H:%M')
+    
+    added = 0
+    records = []
+    try:
+        for page in range(HOURLY_MAX_PAGES):
+            # 回補最多 HOURLY_MAX_PAGES 頁，每頁前續約，避免租約在回補途中過期
+            if not acquire_refresher_lease():
+                logger.warning('更新租約已由其他 worker 取得，停止回補', extra={'cursor': cursor})
+                return 0
+            url = AQI_HOURLY_API_URL + '&' + urlencode({
+                'filters': f"SiteName,EQ,{HOURLY_SITE_NAME}|MonitorDate,GE,{cursor}",
+                'limit': HOURLY_PAGE_SIZE,
+                'offset': page * HOURLY_PAGE_SIZE,
+            })
+            status_code, data = fetch_upstream_json(url, verify=False, conditional=False, extract=extract_hourly_records)
+            if data is None:
+                # 例如 204 等沒有內容的回應，視為該頁失敗
+                raise ValueError(f'小時值 API 回應 {status_code} 沒有內容')
+            page_records = data.get('records') or []
+            records.extend(page_records)
+            if len(page_records) < HOURLY_PAGE_SIZE:
+                break
+    except (requests.RequestException, ValueError) as e:
+        logger.warning('小時值 API 呼叫失敗', extra={'error': str(e)})
+    else:
+        added = record_hourly_history(records)
+    logger.info('小時值歷史更新', extra={'cursor': cursor, 'added': added})
+    if added:
+        hourly_analytics.update()
+    return added
+
+@atexit.register
+def release_refresher_lease():
+    """行程結束時釋放租約，讓其他 worker 立即接手"""
+    if not SHARED_STORE_PATH:
+        return
+    try:
+        get_store_connection().execute('DELETE FROM refresher_lease WHERE id = 1 AND owner = ?', (WORKER_ID,))
+    except sqlite3.Error:
+        pass
+
+# 即時空品不加測站篩選，一次取得全部測站(約 80 站)
+AQI_API_URL = "https://data.moenv.gov.tw/api/v2/aqx_p_432?format=json&limit=1000&api_key=e0438a06-74df-4300-8ce5-edfcb08c82b8"
+AQI_HOURLY_API_URL = "https://data.moenv.gov.tw/api/v2/aqx_p_213?language=en&api_key=e0438a06-74df-4300-8ce5-edfcb08c82b8"
+# 苗栗縣鄉鎮預報不加地點篩選，一次取得全縣 18 個鄉鎮
+FORECAST_API_URL = "https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-013?Authorization=CWA-BC6838CC-5D26-43CD-B524-8A522B534959"
 WEATHER_ALERT_API_URL = "https://opendata.cwa.gov.tw/api/v1/rest/datastore/W-C0033-001?Authorization=CWA-BC6838CC-5D26-43CD-B524-8A522B534959&locationName=苗栗縣"
 
+# 共用 HTTP 連線池：重複使用與環境部、氣象署主機的 TCP/TLS 連線，並要求 gzip 壓縮
+http_session = requests.Session()
+http_session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+# 條件式請求快取：URL → 上游回傳的 ETag / Last-Modified 與對應的解析結果
+conditional_cache = {}
+
+# 上游指標以資料集代碼(網址最後一段，例如 aqx_p_432)區分；耗時包含串流下載與解析
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15)
+upstream_latency = Histogram('toufen_upstream_request_duration_seconds', '上游 API 請求耗時(含下載與解析)',
+                             ('upstream',), UPSTREAM_BUCKETS)
+upstream_responses = Counter('toufen_upstream_responses_total', '上游 API 回應數(依狀態碼)', ('upstream', 'status'))
+upstream_errors = Counter('toufen_upstream_errors_total', '上游 API 請求失敗數(依例外類型)', ('upstream', 'error'))
+
+def fetch_upstream_json(url, verify=True, conditional=True, extract=None):
+    """透過共用連線池抓取上游 JSON，回傳 (狀態碼, 數據)；錯誤狀態碼拋出例外，200 以外的成功回應數據為 None
+    上游有提供 ETag / Last-Modified 時送出條件式請求，收到 304 則沿用上次解析的數據
+    每次網址都不同的請求(例如增量查詢)以 conditional=False 略過條件式快取
+    extract(response) 從回應串流中只取出需要的部分，快取的也是取出後的結果"""
+    headers = {}
+    cached = conditional_cache.get(url) if conditional else None
+    if cached:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    
+    upstream = urlsplit(url).path.rsplit('/', 1)[-1]
+    start = time.perf_counter()
+    try:
+        with http_session.get(url, headers=headers, timeout=10, verify=verify, stream=True) as response:
+            upstream_responses.inc(upstream, str(response.status_code))
+            if response.status_code == 304 and cached:
+                return response.status_code, cached['data']
+            response.raise_for_status()
+            if response.status_code != 200:
+                return response.status_code, None
+            data = extract(response) if extract else response.json()
+    except Exception as e:
+        upstream_errors.inc(upstream, type(e).__name__)
+        raise
+    finally:
+        upstream_latency.observe(upstream, value=time.perf_counter() - start)
+    
+    if not conditional:
+        return response.status_code, data
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if etag or last_modified:
+        conditional_cache[url] = {'etag': etag, 'last_modified': last_modified, 'data': data}
+    else:
+        conditional_cache.pop(url, None)
+    return response.status_code, data
+
+# 串流解析：有安裝 ijson 時邊下載邊解析，一次只在記憶體中建立一個陣列元素，取出需要的欄位後即丟棄
+# 未安裝時退回 response.json()，結果相同
+def iter_json_prefix(node, parts):
+    """在已解析的 JSON 中依 ijson 前綴(例如 records.item)逐一取出元素"""
+    if not parts:
+        yield node
+        return
+    part, rest = parts[0], parts[1:]
+    if part == 'item':
+        for child in node if isinstance(node, list) else []:
+            yield from iter_json_prefix(child, rest)
+    elif isinstance(node, dict) and part in node:
+        yield from iter_json_prefix(node[part], rest)
+
+def stream_json_items(response, prefix, keep, scalars=()):
+    """逐一解析 prefix 下的陣列元素，每個元素只保留 keep(元素) 的結果
+    回傳 (保留的結果清單, {scalars 中的頂層欄位: 值})"""
+    if ijson is None:
+        data = response.json()
+        return [keep(item) for item in iter_json_prefix(data, prefix.split('.'))], {k: data.get(k) for k in scalars}
+    
+    captured = {}
+    def events():
+        for path, event, value in ijson.parse(response.raw, use_float=True):
+            if path in scalars:
+                captured[path] = value
+            yield path, event, value
+    response.raw.decode_content = True
+    items = [keep(item) for item in ijson.items(events(), prefix)]
+    return items, captured
+
+# 即時空品與小時值只保留用到的欄位
+AQI_RECORD_FIELDS = ('sitename', 'county', 'aqi', 'pm2.5', 'pm2.5_avg', 'pm10', 'pm10_avg', 'o3', 'publishtime')
+HOURLY_RECORD_FIELDS = ('sitename', 'monitordate', 'itemname', 'concentration')
+
+def extract_records(fields):
+    def extract(response):
+        records, _ = stream_json_items(response, 'records.item', lambda r: {k: r.get(k) for k in fields if k in r})
+        return {'records': records}
+    return extract
+
+extract_aqi_records = extract_records(AQI_RECORD_FIELDS)
+extract_hourly_records = extract_records(HOURLY_RECORD_FIELDS)
+
+def extract_forecast_locations(response):
+    """全縣預報每個鄉鎮解析完就轉為欄式時間軸，不保留原始的要素清單(含長篇天氣描述)"""
+    locations, scalars = stream_json_items(
+        response, 'records.Locations.item.Location.item',
+        lambda location: (location.get('LocationName', DEFAULT_LOCATION), build_columns(location.get('WeatherElement', []))),
+        scalars=('success',)
+    )
+    return {'success': scalars.get('success'), 'locations': locations}
+
 def get_taipei_time():
     return datetime.now(TAIPEI_TZ)
 
@@ -63,155 +632,65 @@ def get_comfort_emoji_color(desc):
     else:
         return '😐', 'yellow'
 
-# 抓取天氣預報(左側)
+def next_forecast_hour():
+    """頁面顯示的預報時間：目前時間的下一個整點(epoch 秒)"""
+    next_hour = (get_taipei_time() + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+    return int(next_hour.timestamp())
+
+def build_forecast_data(name, timeline, target):
+    """由預報時間軸取出 target 整點的預報(ForecastReading)，沒有溫度資料時回傳 None"""
+    hours = timeline.hours()
+    if not hours:
+        return None
+    
+    # 各要素依各自的時間區間查詢；如果找不到，用第一筆
+    if timeline.lookup('溫度', target) is None:
+        logger.info('找不到下一整點的預報，使用第一筆', extra={'location': name, 'hour': format_time(target, '%H:00')})
+        target = hours[0]
+    return ForecastReading(location_name=name, forecast_time=target, **timeline.at(target))
+
+def build_forecast_locations(timelines, target):
+    """由各鄉鎮的時間軸建立 {鄉鎮: ForecastReading} 索引，略過沒有資料的鄉鎮"""
+    locations = {}
+    for name, columns in timelines.items():
+        forecast_data = build_forecast_data(name, ForecastTimeline(columns), target)
+        if forecast_data is not None:
+            locations[name] = forecast_data
+    return locations
+
+# 抓取天氣預報(左側)：一次下載全縣預報，依鄉鎮名稱建立索引
+# 每個鄉鎮的預報解析為欄式時間軸存入快照，頁面數據與 /api/forecast 都由時間軸查詢
 def fetch_weather_forecast():
-    global forecast_data
     try:
-        print(f"正在呼叫頭份預報 API...")
-        response = requests.get(FORECAST_API_URL, timeout=10)
-        print(f"預報 API 狀態碼: {response.status_code}")
-        response.raise_for_status()
-        data = response.json()
+        status_code, data = fetch_upstream_json(FORECAST_API_URL, extract=extract_forecast_locations)
+        logger.debug('預報 API 回應', extra={'status': status_code})
         
-        if data.get('success') == 'true' and data.get('records'):
-            locations = data['records']['Locations'][0]['Location']
+        if data.get('success') == 'true' and data.get('locations'):
+            locations = build_forecast_locations(dict(data['locations']), next_forecast_hour())
+            timelines = {name: columns for name, columns in data['locations'] if name in locations}
             
-            if len(locations) > 0:
-                location = locations[0]
-                weather_elements = location['WeatherElement']
-                
-                # 取得第一筆時間資料(最接近當前)
-                temp_element = next((e for e in weather_elements if e['ElementName'] == '溫度'), None)
-                feels_element = next((e for e in weather_elements if e['ElementName'] == '體感溫度'), None)
-                comfort_element = next((e for e in weather_elements if e['ElementName'] == '舒適度指數'), None)
-                humidity_element = next((e for e in weather_elements if e['ElementName'] == '相對濕度'), None)
-                wind_speed_element = next((e for e in weather_elements if e['ElementName'] == '風速'), None)
-                wind_dir_element = next((e for e in weather_elements if e['ElementName'] == '風向'), None)
-                weather_element = next((e for e in weather_elements if e['ElementName'] == '天氣現象'), None)
-                pop_element = next((e for e in weather_elements if e['ElementName'] == '3小時降雨機率'), None)
-                
-                # 取第一筆資料
-                forecast_time = 'N/A'
-                temp = 'N/A'
-                feels_like = 'N/A'
-                comfort_index = 'N/A'
-                comfort_desc = '無資料'
-                humidity = 'N/A'
-                wind_speed = 'N/A'
-                wind_scale = 'N/A'
-                wind_dir = 'N/A'
-                weather_desc = 'N/A'
-                rain_prob = 'N/A'
-                
-                if temp_element and len(temp_element['Time']) > 0:
-                    # 取得當前時間並計算下一個整點
-                    current_time = get_taipei_time()
-                    next_hour = (current_time + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
-                    print(f"  當前時間: {current_time.strftime('%H:%M')}, 尋找下一整點: {next_hour.strftime('%H:00')}")
-                    
-                    # 找到符合下一整點的預報
-                    target_time = None
-                    target_index = 0
-                    for i, time_data in enumerate(temp_element['Time']):
-                        data_time_str = time_data.get('DataTime', '')
-                        try:
-                            data_time = datetime.fromisoformat(data_time_str.replace('+08:00', ''))
-                            if data_time.hour == next_hour.hour and data_time.date() == next_hour.date():
-                                target_time = time_data
-                                target_index = i
-                                break
-                        except:
-                            continue
-                    
-                    # 如果找不到，用第一筆
-                    if target_time is None:
-                        print(f"  ⚠️ 找不到 {next_hour.strftime('%H:00')} 的預報，使用第一筆")
-                        target_time = temp_element['Time'][0]
-                        target_index = 0
-                    
-                    forecast_time = target_time.get('DataTime', 'N/A')
-                    temp = target_time['ElementValue'][0].get('Temperature', 'N/A')
-                    print(f"  ✓ 預報時間: {forecast_time}")
-                    
-                    # 其他氣象要素使用相同索引
-                    if feels_element and len(feels_element['Time']) > target_index:
-                        feels_like = feels_element['Time'][target_index]['ElementValue'][0].get('ApparentTemperature', 'N/A')
-                    
-                    if comfort_element and len(comfort_element['Time']) > target_index:
-                        comfort_value = comfort_element['Time'][target_index]['ElementValue'][0]
-                        comfort_index = comfort_value.get('ComfortIndex', 'N/A')
-                        comfort_desc = comfort_value.get('ComfortIndexDescription', '無資料')
-                    
-                    if humidity_element and len(humidity_element['Time']) > target_index:
-                        humidity = humidity_element['Time'][target_index]['ElementValue'][0].get('RelativeHumidity', 'N/A')
-                    
-                    if wind_speed_element and len(wind_speed_element['Time']) > target_index:
-                        wind_value = wind_speed_element['Time'][target_index]['ElementValue'][0]
-                        wind_speed = wind_value.get('WindSpeed', 'N/A')
-                        wind_scale = wind_value.get('BeaufortScale', 'N/A')
-                    
-                    if wind_dir_element and len(wind_dir_element['Time']) > target_index:
-                        wind_dir = wind_dir_element['Time'][target_index]['ElementValue'][0].get('WindDirection', 'N/A')
-                    
-                    if weather_element and len(weather_element['Time']) > target_index:
-                        weather_desc = weather_element['Time'][target_index]['ElementValue'][0].get('Weather', 'N/A')
-                    
-                    if pop_element and len(pop_element['Time']) > target_index:
-                        rain_prob = pop_element['Time'][target_index]['ElementValue'][0].get('ProbabilityOfPrecipitation', 'N/A')
-                    
-                    # 組合風速風向顯示
-                    if wind_dir != 'N/A' and wind_speed != 'N/A' and wind_scale != 'N/A':
-                        wind_display = f"{wind_dir} 平均風速{wind_scale}級(每秒{wind_speed}公尺)"
-                    else:
-                        wind_display = 'N/A'
-                    
-                    # 取得舒適度表情
-                    comfort_emoji, comfort_color = get_comfort_emoji_color(comfort_desc)
-
-                    
-                    try:
-                        dt = datetime.fromisoformat(forecast_time.replace('+08:00', ''))
-                        forecast_time_display = dt.strftime('%m/%d %H:%M')
-                    except:
-                        forecast_time_display = forecast_time
-                    
-                    forecast_data = {
-                        'temp': temp,
-                        'feels_like': feels_like,
-                        'comfort_index': comfort_index,
-                        'comfort_desc': comfort_desc,
-                        'comfort_emoji': comfort_emoji,
-                        'comfort_color': comfort_color,
-                        'humidity': humidity,
-                        'wind_display': wind_display,
-                        'weather_desc': weather_desc,
-                        'pop': rain_prob,
-                        'forecast_time': forecast_time_display,
-                        'has_data': True,
-                        'last_fetch': get_taipei_time()
-                    }
-                    
-                    print(f"✓ 預報數據更新成功")
-                    print(f"  溫度: {temp}°C, 舒適度: {comfort_desc}")
-                    return
-        
-        forecast_data['has_data'] = False
+            if locations:
+                default_data = locations.get(DEFAULT_LOCATION)
+                logger.info('預報數據更新成功', extra={
+                    'locations': len(locations),
+                    'forecast_time': format_time(default_data.forecast_time, '%m/%d %H:%M') if default_data else None,
+                    'temp': default_data.temp if default_data else None,
+                })
+                return {
+                    'locations': locations,
+                    'timelines': timelines,
+                    'last_fetch': get_taipei_time()
+                }
         
-    except Exception as e:
-        print(f"× 抓取預報數據失敗: {e}")
-        import traceback
-        traceback.print_exc()
-        forecast_data['has_data'] = False
+    except Exception:
+        logger.exception('抓取預報數據失敗')
+    return None
 
 # 抓取天氣警特報
 def fetch_weather_alerts():
-    global alert_data
     try:
-        print(f"正在呼叫天氣警特報 API...")
-        response = requests.get(WEATHER_ALERT_API_URL, timeout=10)
-        print(f"警特報 API 狀態碼: {response.status_code}")
-        response.raise_for_status()
-        data = response.json()
+        status_code, data = fetch_upstream_json(WEATHER_ALERT_API_URL)
+        logger.debug('警特報 API 回應', extra={'status': status_code})
         
         if data.get('success') == 'true' and data.get('records'):
             locations = data['records'].get('location', [])
@@ -256,9 +735,10 @@ def fetch_weather_alerts():
                         'last_fetch': get_taipei_time()
                     }
                     
-                    print(f"✓ 警特報數據更新成功：{len(alerts_list)} 則警報")
-                    for alert in alerts_list:
-                        print(f"  ⚠️ {alert['phenomena']}{alert['significance']}")
+                    logger.info('警特報數據更新成功', extra={
+                        'alerts': [alert['phenomena'] + alert['significance'] for alert in alerts_list]
+                    })
+                    return alert_data
                 else:
                     # 無警報
                     alert_data = {
@@ -266,228 +746,317 @@ def fetch_weather_alerts():
                         'alerts': [],
                         'last_fetch': get_taipei_time()
                     }
-                    print(f"✓ 目前無天氣警特報")
-            else:
-                alert_data['has_alert'] = False
-        else:
-            alert_data['has_alert'] = False
+                    logger.info('警特報數據更新成功', extra={'alerts': []})
+                    return alert_data
             
-    except Exception as e:
-        print(f"× 抓取警特報數據失敗: {e}")
-        import traceback
-        traceback.print_exc()
-        alert_data['has_alert'] = False
+    except Exception:
+        logger.exception('抓取警特報數據失敗')
+    return None
         
-# 抓取空氣品質(右側)
+# 小時值 API 的測項名稱對應
+HOURLY_ITEM_NAMES = {
+    'pm25_avg': 'PM2.5',
+    'pm10_avg': 'PM10',
+    'pm25': 'PM2.5',
+    'pm10': 'PM10',
+    'o3': 'Ozone'
+}
+
+# 即時觀測 API 的欄位對應
+AQI_RECORD_KEYS = {
+    'aqi': 'aqi',
+    'pm25_avg': 'pm2.5_avg',
+    'pm10_avg': 'pm10_avg',
+    'pm25': 'pm2.5',
+    'pm10': 'pm10',
+    'o3': 'o3'
+}
+
+def calculate_change(current, previous_data, key):
+    """計算變化量：當前值 - 前一小時值(取到小數一位)，缺值時回傳 None"""
+    if current is None or previous_data is None:
+        return None
+    previous_value = previous_data.get(HOURLY_ITEM_NAMES.get(key))
+    if previous_value is None:
+        return None
+    return round(current - previous_value, 1)
+
+def calculate_changes(values, previous_hour_data):
+    """計算各測項的變化量（當前 - 前一小時），小時值 API 沒有 AQI"""
+    return {
+        f'{name}_change': calculate_change(values[name], previous_hour_data, name)
+        for name in HOURLY_ITEM_NAMES
+    }
+
+def previous_hour_values(publish_hour):
+    """由本機歷史取得發布時間前一個整點的測項，沒有時回傳 None"""
+    if publish_hour is None:
+        return None
+    return hourly_history.values_at(publish_hour - 3600) or None
+
+def build_site_data(record, previous_hour_data=None, update_time=None):
+    """將單一測站的即時觀測紀錄轉為 SiteReading；previous_hour_data 為前一小時測項(只有預設測站有)"""
+    values = {name: to_float(record.get(key)) for name, key in AQI_RECORD_KEYS.items()}
+    changes = calculate_changes(values, previous_hour_data)
+    update_time = update_time or get_taipei_time()
+    return SiteReading(
+        site_name=record.get('sitename', DEFAULT_SITE),
+        county=record.get('county', ''),
+        publish_time=parse_monitor_time(record.get('publishtime')),
+        update_time=int(update_time.timestamp()),
+        **values,
+        **changes
+    )
+
+# 抓取空氣品質(右側)：一次下載全部測站，依測站名稱與縣市建立索引
 def fetch_air_quality_data():
-    global latest_data
     try:
-        print(f"正在呼叫 AQI API...")
+        # 1. 依序模式先增量抓取小時值，變化量直接使用最新歷史
+        # 並行模式下回補由 refresh_data 另外送出，即時數據不等待分頁回補即發布
+        if not CONCURRENT_FETCH:
+            ingest_hourly_history()
+        status_code, data = fetch_upstream_json(AQI_API_URL, verify=False, extract=extract_aqi_records)
         
-        # 1. 先呼叫小時值 API，取得過去兩小時的測項數據
-        print(f"  → 呼叫小時值 API (取過去兩小時數據)...")
-        hourly_response = requests.get(AQI_HOURLY_API_URL, timeout=10, verify=False)
-        print(f"  → 小時值 API 狀態碼: {hourly_response.status_code}")
-        
-        previous_hour_data = None
-        if hourly_response.status_code == 200:
-            hourly_data = hourly_response.json()
-            if hourly_data.get('records') and len(hourly_data['records']) > 0:
-                hourly_records = hourly_data['records']
-                print(f"  ✓ 取得 {len(hourly_records)} 筆小時值數據")
-                
-                # 將垂直格式轉換為水平格式
-                # 垂直: [{"itemname": "PM2.5", "concentration": "10", "monitordate": "2025-10-20 19:00"}, ...]
-                # 水平: {"2025-10-20 19:00": {"PM2.5": "10", "PM10": "25", ...}, ...}
-                grouped_data = {}
-                for record in hourly_records:
-                    if record.get('sitename') == 'Toufen':
-                        monitor_date = record.get('monitordate', '')
-                        item_name = record.get('itemname', '')
-                        concentration = record.get('concentration', 'N/A')
-                        
-                        if monitor_date not in grouped_data:
-                            grouped_data[monitor_date] = {}
-                        
-                        grouped_data[monitor_date][item_name] = concentration
-                
-                # 排序取得最新兩個小時
-                sorted_dates = sorted(grouped_data.keys(), reverse=True)
-                print(f"  ✓ 找到 {len(sorted_dates)} 個不同時間點: {sorted_dates[:2]}")
-                
-                if len(sorted_dates) >= 2:
-                    latest_hour = sorted_dates[0]
-                    previous_hour = sorted_dates[1]
-                    previous_hour_data = grouped_data[previous_hour]
-                    print(f"  ✓ 前一小時數據: {previous_hour}")
-                    print(f"  🔍 前一小時測項: {list(previous_hour_data.keys())}")
-                elif len(sorted_dates) == 1:
-                    print(f"  ⚠️ 只有1個時間點的數據，無法計算變化量")
-                else:
-                    print(f"  ⚠️ 無有效數據")
-            else:
-                print(f"  ⚠️ 小時值 API 無數據")
-        else:
-            print(f"  ⚠️ 小時值 API 呼叫失敗")
-        
-        # 2. 呼叫即時觀測 API，取得當前數據
-        print(f"  → 呼叫即時觀測 API...")
-        response = requests.get(AQI_API_URL, timeout=10, verify=False)
-        print(f"  → 即時 API 狀態碼: {response.status_code}")
-        
-        response.raise_for_status()
-        data = response.json()
+        # 2. 即時觀測 API，取得全部測站的當前數據
+        logger.debug('即時 API 回應', extra={'status': status_code})
         
         if data.get('records') and len(data['records']) > 0:
-            records = data['records']
-            
-            valid_records = [r for r in records if r.get('publishtime')]
-            if valid_records:
-                valid_records.sort(key=lambda x: x.get('publishtime', ''), reverse=True)
-                record = valid_records[0]
-            else:
-                record = records[0]
+            # 每個測站只保留發布時間最新的一筆
+            latest_records = {}
+            for record in data['records']:
+                site = record.get('sitename')
+                if not site:
+                    continue
+                current = latest_records.get(site)
+                if current is None or record.get('publishtime', '') > current.get('publishtime', ''):
+                    latest_records[site] = record
             
-            # 當前數據
-            aqi = record.get('aqi', 'N/A')
-            pm25 = record.get('pm2.5', 'N/A')
-            pm25_avg = record.get('pm2.5_avg', 'N/A')
-            pm10 = record.get('pm10', 'N/A')
-            pm10_avg = record.get('pm10_avg', 'N/A')
-            o3 = record.get('o3', 'N/A')
+            # 3. 前一小時數據由本機歷史取得(發布時間的前一個整點)，只有預設測站有逐時歷史
+            default_record = latest_records.get(DEFAULT_SITE)
+            publish_time_str = default_record.get('publishtime', '') if default_record else ''
+            previous_hour_data = previous_hour_values(parse_monitor_time(publish_time_str))
+            if not previous_hour_data:
+                logger.info('無前一小時數據，變化量為空', extra={'publish_time': publish_time_str})
             
-            publish_time_str = record.get('publishtime', '')
+            # 4. 建立各測站數據與縣市索引
+            fetch_time = get_taipei_time()
+            sites = {}
+            counties = {}
+            for site, record in latest_records.items():
+                previous = previous_hour_data if site == DEFAULT_SITE else None
+                sites[site] = build_site_data(record, previous, fetch_time)
+                counties.setdefault(record.get('county', ''), []).append(site)
             
-            # 3. 計算變化量（當前 - 前一小時）
-            def calculate_change(current, previous_data, key):
-                """計算變化量：當前值 - 前一小時值"""
-                if current == 'N/A' or current == '' or previous_data is None:
-                    return None
-                
-                # 小時值 API 的測項名稱對應
-                item_name_mapping = {
-                    'pm2.5_avg': 'PM2.5',
-                    'pm10_avg': 'PM10',
-                    'pm2.5': 'PM2.5',
-                    'pm10': 'PM10',
-                    'o3': 'Ozone'
-                }
-                
-                item_name = item_name_mapping.get(key)
-                if not item_name:
-                    return None
-                
-                previous_value = previous_data.get(item_name, 'N/A')
-                if previous_value == 'N/A' or previous_value == '':
-                    return None
-                
-                try:
-                    curr_val = float(current)
-                    prev_val = float(previous_value)
-                    change = curr_val - prev_val
-                    if change > 0:
-                        result = f"↑ +{change:.1f}"
-                    elif change < 0:
-                        result = f"↓ {change:.1f}"
-                    else:
-                        result = "─ 0"
-                    print(f"  計算 {key} ({item_name}): {prev_val} → {curr_val} = {result}")
-                    return result
-                except Exception as e:
-                    print(f"  計算 {key} 錯誤: {e}")
-                    return None
-            
-            # 計算所有變化量
-            if previous_hour_data:
-                print(f"  → 計算變化量（當前 vs 前一小時）")
-                aqi_change = None  # 小時值 API 沒有 AQI
-                pm25_avg_change = calculate_change(pm25_avg, previous_hour_data, 'pm2.5_avg')
-                pm10_avg_change = calculate_change(pm10_avg, previous_hour_data, 'pm10_avg')
-                pm10_change = calculate_change(pm10, previous_hour_data, 'pm10')
-                pm25_change = calculate_change(pm25, previous_hour_data, 'pm2.5')
-                o3_change = calculate_change(o3, previous_hour_data, 'o3')
-            else:
-                print(f"  ⚠️ 無前一小時數據，變化量為空")
-                aqi_change = None
-                pm25_avg_change = None
-                pm10_avg_change = None
-                pm10_change = None
-                pm25_change = None
-                o3_change = None
-            
-            # 4. 判斷空氣品質等級
-            def get_level_info(value, thresholds, labels):
-                if value == 'N/A' or value == '':
-                    return 'gray', '無資料'
-                try:
-                    val = float(value)
-                    if val <= thresholds[0]:
-                        return 'green', labels[0]
-                    elif val <= thresholds[1]:
-                        return 'yellow', labels[1]
-                    elif val <= thresholds[2]:
-                        return 'orange', labels[2]
-                    else:
-                        return 'red', labels[3]
-                except:
-                    return 'gray', '無資料'
-            
-            aqi_color, aqi_label = get_level_info(aqi, [50, 100, 150], ['良好', '普通', '對敏感族群不健康', '不健康'])
-            pm25_avg_color, pm25_avg_label = get_level_info(pm25_avg, [15.4, 35.4, 54.4], ['良好', '普通', '對敏感族群不健康', '不健康'])
-            pm10_avg_color, pm10_avg_label = get_level_info(pm10_avg, [54, 125, 254], ['良好', '普通', '對敏感族群不健康', '不健康'])
-            pm10_color, pm10_label = get_level_info(pm10, [54, 125, 254], ['良好', '普通', '對敏感族群不健康', '不健康'])
-            pm25_color, pm25_label = get_level_info(pm25, [15.4, 35.4, 54.4], ['良好', '普通', '對敏感族群不健康', '不健康'])
-            o3_color, o3_label = get_level_info(o3, [54, 70, 85], ['良好', '普通', '對敏感族群不健康', '不健康'])
-            
-            # 5. 更新全域數據
-            latest_data = {
-                'aqi': aqi, 'aqi_color': aqi_color, 'aqi_label': aqi_label, 'aqi_change': aqi_change,
-                'pm25_avg': pm25_avg, 'pm25_avg_color': pm25_avg_color, 'pm25_avg_label': pm25_avg_label, 'pm25_avg_change': pm25_avg_change,
-                'pm10_avg': pm10_avg, 'pm10_avg_color': pm10_avg_color, 'pm10_avg_label': pm10_avg_label, 'pm10_avg_change': pm10_avg_change,
-                'pm10': pm10, 'pm10_color': pm10_color, 'pm10_label': pm10_label, 'pm10_change': pm10_change,
-                'pm25': pm25, 'pm25_color': pm25_color, 'pm25_label': pm25_label, 'pm25_change': pm25_change,
-                'o3': o3, 'o3_color': o3_color, 'o3_label': o3_label, 'o3_change': o3_change,
-                'update_time': get_taipei_time().strftime('%Y-%m-%d %H:%M:%S'),
-                'site_name': record.get('sitename', '頭份'),
-                'publish_time': record.get('publishtime', 'N/A'),
-                'has_data': True,
-                'last_fetch': get_taipei_time()
+            default_data = sites.get(DEFAULT_SITE)
+            logger.info('AQI 數據更新成功', extra={
+                'sites': len(sites),
+                'counties': len(counties),
+                'publish_time': publish_time_str,
+                'aqi': default_data.aqi if default_data else None,
+            })
+            return {
+                'sites': sites,
+                'counties': counties,
+                'last_fetch': fetch_time
             }
             
-            print(f"✅ AQI 數據更新成功")
-            print(f"   當前時間: {publish_time_str}")
-            if previous_hour_data:
-                print(f"   前一小時有 {len(previous_hour_data)} 個測項")
-            print(f"   當前 AQI: {aqi} (無變化量)")
-            print(f"   PM2.5 avg: {pm25_avg}, 變化: {pm25_avg_change}")
-            
-        else:
-            latest_data['has_data'] = False
-            
-    except Exception as e:
-        print(f"× 抓取 AQI 數據失敗: {e}")
-        import traceback
-        traceback.print_exc()
-        latest_data['has_data'] = False
-def should_fetch_data():
-    """檢查是否需要更新數據 - 三個數據源都要考慮"""
-    current_time = get_taipei_time()
-    
-    # 如果任一數據未初始化,需要更新
-    if latest_data['last_fetch'] is None or forecast_data['last_fetch'] is None or alert_data['last_fetch'] is None:
-        return True
-    
-    # 檢查空品數據是否超過3分鐘
-    aqi_expired = current_time - latest_data['last_fetch'] > timedelta(minutes=3)
-    
-    # 檢查預報數據是否超過3分鐘
-    forecast_expired = current_time - forecast_data['last_fetch'] > timedelta(minutes=3)
+    except Exception:
+        logger.exception('抓取 AQI 數據失敗')
+    return None
+
+# 數據源名稱與抓取函式的對應，抓取函式成功時回傳新數據，失敗時回傳 None
+SOURCE_FETCHERS = {
+    'aqi': fetch_air_quality_data,
+    'forecast': fetch_weather_forecast,
+    'alert': fetch_weather_alerts,
+}
+
+def is_source_expired(name, current_time=None):
+    """檢查單一數據源是否超過 TTL；失敗後依重試間隔再嘗試"""
+    entry = source_cache[name]
+    current_time = current_time or get_taipei_time()
     
-    # 檢查警特報數據是否超過3分鐘
-    alert_expired = current_time - alert_data['last_fetch'] > timedelta(minutes=3)
+    last_success = current_snapshot.fetched_at[name]
+    if last_success is not None and current_time - last_success < timedelta(seconds=entry['ttl']):
+        return False
     
-    # 任一個過期就需要更新
-    return aqi_expired or forecast_expired or alert_expired
+    if entry['last_attempt'] is None:
+        return True
+    retry = min(SOURCE_RETRY_SECONDS, entry['ttl'])
+    return current_time - entry['last_attempt'] >= timedelta(seconds=retry)
+
+def get_expired_sources():
+    current_time = get_taipei_time()
+    return [name for name in source_cache if is_source_expired(name, current_time)]
+
+def should_fetch_data():
+    """檢查是否有任一數據源需要更新"""
+    return len(get_expired_sources()) > 0
+
+refresh_duration = Histogram('toufen_refresh_duration_seconds', '單一數據源更新耗時(含所有上游請求)',
+                             ('source',), UPSTREAM_BUCKETS)
+refresh_results = Counter('toufen_refresh_total', '數據源更新次數(依結果)', ('source', 'result'))
+
+def refresh_source(name):
+    """抓取單一數據源，成功時發布新快照；失敗時保留上一次成功的數據"""
+    source_cache[name]['last_attempt'] = get_taipei_time()
+    # 更新耗時可能超過租約時間，每個數據源開始前續約；租約已被其他 worker 取得時交由對方更新
+    if not acquire_refresher_lease():
+        logger.warning('更新租約已由其他 worker 取得，略過數據源', extra={'source': name})
+        return False
+    start = time.perf_counter()
+    data = SOURCE_FETCHERS[name]()
+    refresh_duration.observe(name, value=time.perf_counter() - start)
+    if data is None:
+        refresh_results.inc(name, 'failure')
+        restore_source_from_disk(name)
+        return False
+    refresh_results.inc(name, 'success')
+    publish_source(name, data)
+    return True
+
+def apply_hourly_backfill(hourly_future):
+    """並行模式下小時值回補完成後，以新的歷史重新計算預設測站的變化量並發布(保留原抓取時間)"""
+    try:
+        added = hourly_future.result()
+    except Exception:
+        logger.exception('小時值回補失敗')
+        return
+    if not added:
+        return
+    aqi = current_snapshot.aqi
+    reading = aqi['sites'].get(DEFAULT_SITE)
+    if reading is None:
+        return
+    values = {name: getattr(reading, name) for name in HOURLY_ITEM_NAMES}
+    changes = calculate_changes(values, previous_hour_values(reading.publish_time))
+    publish_source(
+        'aqi',
+        {**aqi, 'sites': {**aqi['sites'], DEFAULT_SITE: replace(reading, **changes)}},
+        fetched_at_time=current_snapshot.fetched_at['aqi']
+    )
+
+def restore_source_from_disk(name):
+    """抓取失敗且目前沒有該數據源的數據時，改用磁碟快照中的數據(保留原抓取時間)"""
+    if current_snapshot.fetched_at[name] is not None:
+        return
+    persisted = load_persisted_snapshot()
+    if persisted is None or persisted.fetched_at[name] is None:
+        return
+    publish_source(name, getattr(persisted, name), fetched_at_time=persisted.fetched_at[name])
+    logger.warning('已改用磁碟快照中的數據', extra={
+        'source': name, 'fetched_at': persisted.fetched_at[name].strftime('%Y-%m-%d %H:%M:%S')
+    })
+
+# 更新數據源，未指定時只更新已過期的數據源
+# 已有更新進行中時直接返回，確保同一時間只有一個更新在執行
+# 並行模式下各數據源完成後立即發布，較慢的來源不會延遲其他來源
+# 多 worker 時只有取得租約者呼叫上游，其他 worker 改為載入共用快照
+def refresh_data(sources=None):
+    if not fetch_lock.acquire(blocking=False):
+        return
+    try:
+        sync_from_shared_store()
+        if not acquire_refresher_lease():
+            # 記錄嘗試時間，避免數據過期期間每個請求都觸發檢查
+            attempt_time = get_taipei_time()
+            for name in get_expired_sources():
+                source_cache[name]['last_attempt'] = attempt_time
+            return
+        if sources is None:
+            sources = get_expired_sources()
+        if not sources:
+            return
+        start = time.monotonic()
+        if CONCURRENT_FETCH:
+            futures = [fetch_executor.submit(refresh_source, name) for name in sources]
+            # 小時值回補與即時空品同時送出，即時數據先發布，回補新增資料後再更新變化量
+            hourly_future = fetch_executor.submit(ingest_hourly_history) if 'aqi' in sources else None
+            wait(futures + [hourly_future] if hourly_future else futures)
+            if hourly_future is not None:
+                apply_hourly_backfill(hourly_future)
+        else:
+            for name in sources:
+                refresh_source(name)
+        logger.info('數據更新完成', extra={'sources': sources, 'seconds': round(time.monotonic() - start, 2)})
+    finally:
+        fetch_lock.release()
+
+def trigger_refresh():
+    """在背景啟動一次更新，不等待結果"""
+    if fetch_lock.locked():
+        return
+    Thread(target=refresh_data, name='data-refresh', daemon=True).start()
+
+# 請求取得快照時的數據狀態：hit 為所有數據源都在 TTL 內，miss 為有數據源過期並觸發背景更新
+data_cache_requests = Counter('toufen_data_cache_requests_total', '請求取得快照時數據是否在 TTL 內', ('result',))
+
+def get_snapshot():
+    """取得目前快照(無鎖)；數據過期時觸發背景更新，並立即回傳舊快照"""
+    snapshot = current_snapshot
+    if should_fetch_data():
+        data_cache_requests.inc('miss')
+        trigger_refresh()
+    else:
+        data_cache_requests.inc('hit')
+    return snapshot
+
+def collect_snapshot_ages():
+    current_time = get_taipei_time()
+    return {
+        (name,): (current_time - fetched_at).total_seconds()
+        for name, fetched_at in current_snapshot.fetched_at.items() if fetched_at is not None
+    }
+
+snapshot_age = Gauge('toufen_snapshot_age_seconds', '快照中各數據源距上次成功抓取的秒數', ('source',),
+                     collect=collect_snapshot_ages)
+snapshot_version = Gauge('toufen_snapshot_version', '目前快照版本',
+                         collect=lambda: {(): current_snapshot.version})
+
+# 背景更新執行緒：依排程維持數據新鮮，頁面與 API 只讀取最後一次成功的數據
+# 每次檢查都會續約更新租約並同步共用快照，租約過期時由其他 worker 接手
+# 預報 TTL 為一小時，過了整點時由快照中的時間軸重新取出下一整點的預報，不呼叫上游
+forecast_hour = None
+
+def roll_forecast_hour():
+    """下一整點改變時以新的整點重建預報索引並發布(保留原抓取時間)"""
+    global forecast_hour
+    target = next_forecast_hour()
+    if target == forecast_hour or not fetch_lock.acquire(blocking=False):
+        return
+    try:
+        forecast = current_snapshot.forecast
+        if forecast['timelines']:
+            publish_source(
+                'forecast',
+                {**forecast, 'locations': build_forecast_locations(forecast['timelines'], target)},
+                fetched_at_time=current_snapshot.fetched_at['forecast']
+            )
+        forecast_hour = target
+    finally:
+        fetch_lock.release()
+
+def background_refresher():
+    while True:
+        try:
+            if acquire_refresher_lease():
+                roll_forecast_hour()
+                if should_fetch_data():
+                    refresh_data()
+            else:
+                sync_from_shared_store()
+        except Exception:
+            logger.exception('背景更新失敗')
+        time.sleep(REFRESH_CHECK_SECONDS)
+
+def start_background_refresher():
+    """啟動背景更新執行緒(每個行程只啟動一次)"""
+    global refresher_thread
+    with refresher_lock:
+        if refresher_thread is not None and refresher_thread.is_alive():
+            return
+        refresher_thread = Thread(target=background_refresher, name='data-refresher', daemon=True)
+        refresher_thread.start()
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -495,370 +1064,12 @@ HTML_TEMPLATE = """
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>頭份環境監測</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body {
-            font-family: 'Microsoft JhengHei', sans-serif;
-            {% if bg_image %}
-            background: url('/background') center center / cover no-repeat fixed;
-            {% else %}
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            {% endif %}
-            min-height: 100vh;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            padding: 20px;
-        }
-        .main-container {
-            max-width: 1400px;
-            width: 100%;
-            display: grid;
-            grid-template-columns: 350px 1fr;
-            gap: 20px;
-        }
-        .container {
-            background: rgba(255, 255, 255, 0.95);
-            border-radius: 20px;
-            padding: 40px;
-            box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
-        }
-        h1 { text-align: center; color: #333; margin-bottom: 10px; font-size: 2.5em; }
-        h2 { text-align: center; color: #333; margin-bottom: 20px; font-size: 1.8em; }
-        .site-info { text-align: center; color: #666; margin-bottom: 30px; font-size: 1.1em; }
-        
-        .weather-container {
-            background: rgba(255, 255, 255, 0.95);
-            border-radius: 20px;
-            padding: 30px;
-            box-shadow: 0 20px 60px rgba(0, 0, 0, 0.3);
-        }
-        .weather-grid { display: grid; gap: 15px; }
-        .weather-item {
-            background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
-            color: white;
-            padding: 15px;
-            border-radius: 10px;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-        .weather-item.temp { background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%); }
-        .weather-item.feels { background: linear-gradient(135deg, #fa709a 0%, #fee140 100%); }
-        .weather-item.comfort.green { background: linear-gradient(135deg, #00d084 0%, #00a86b 100%); }
-        .weather-item.comfort.yellow { background: linear-gradient(135deg, #ffd700 0%, #ffb900 100%); }
-        .weather-item.comfort.orange { background: linear-gradient(135deg, #ff8c00 0%, #ff6b00 100%); }
-        .weather-item.comfort.red { background: linear-gradient(135deg, #ff4757 0%, #e84118 100%); }
-        .weather-item.comfort.blue { background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%); }
-        .weather-item.comfort.gray { background: linear-gradient(135deg, #95a5a6 0%, #7f8c8d 100%); }
-        .weather-item.humidity { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); }
-        .weather-item.wind { background: linear-gradient(135deg, #a8edea 0%, #fed6e3 100%); color: #333; }
-        .weather-item.pop { background: linear-gradient(135deg, #00c6ff 0%, #0072ff 100%); }
-        .weather-label { font-size: 0.9em; opacity: 0.9; }
-        .weather-value { font-size: 1.5em; font-weight: bold; }
-        .weather-value-large { font-size: 2em; font-weight: bold; }
-        .comfort-emoji { font-size: 2.5em; }
-        .weather-desc-box {
-            background: linear-gradient(135deg, #a8edea 0%, #fed6e3 100%);
-            color: #333;
-            padding: 15px;
-            border-radius: 10px;
-            text-align: center;
-            font-size: 1.2em;
-            font-weight: bold;
-            margin-bottom: 15px;
-        }
-        .forecast-time {
-            text-align: center;
-            color: #666;
-            font-size: 0.9em;
-            margin-top: 15px;
-            padding: 10px;
-            background: #f8f9fa;
-            border-radius: 5px;
-        }
-        
-        .data-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 20px;
-            margin-bottom: 30px;
-        }
-        .data-card {
-            color: white;
-            padding: 25px;
-            border-radius: 15px;
-            text-align: center;
-            box-shadow: 0 5px 15px rgba(0, 0, 0, 0.2);
-            transition: transform 0.3s ease, background 0.5s ease;
-        }
-        .data-card.green { background: linear-gradient(135deg, #00d084 0%, #00a86b 100%); }
-        .data-card.yellow { background: linear-gradient(135deg, #ffd700 0%, #ffb900 100%); }
-        .data-card.orange { background: linear-gradient(135deg, #ff8c00 0%, #ff6b00 100%); }
-        .data-card.red { background: linear-gradient(135deg, #ff4757 0%, #e84118 100%); }
-        .data-card.gray { background: linear-gradient(135deg, #95a5a6 0%, #7f8c8d 100%); }
-        .data-card:hover { transform: translateY(-5px); }
-        .data-label { font-size: 0.9em; opacity: 0.9; margin-bottom: 10px; }
-        .data-value {
-            font-size: 2.5em;
-            font-weight: bold;
-            margin-bottom: 5px;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            gap: 10px;
-        }
-        .data-change {
-            font-size: 0.35em;
-            font-weight: normal;
-            padding: 3px 8px;
-            border-radius: 5px;
-            white-space: nowrap;
-        }
-        .data-change.up { color: #c0392b; background: rgba(192, 57, 43, 0.2); }
-        .data-change.down { color: #27ae60; background: rgba(39, 174, 96, 0.2); }
-        .data-change.same { color: #95a5a6; background: rgba(149, 165, 166, 0.2); }
-        .data-unit { font-size: 0.8em; opacity: 0.8; }
-        .data-status {
-            font-size: 0.85em;
-            margin-top: 8px;
-            padding: 5px 10px;
-            background: rgba(255, 255, 255, 0.2);
-            border-radius: 15px;
-            font-weight: 500;
-        }
-        .update-info {
-            text-align: center;
-            color: #666;
-            padding: 20px;
-            background: #f8f9fa;
-            border-radius: 10px;
-            margin-top: 20px;
-        }
-        .update-time { font-weight: bold; color: #667eea; }
-        .refresh-note { margin-top: 10px; font-size: 0.9em; color: #888; }
-        .error-message {
-            background: #fff3cd;
-            color: #856404;
-            padding: 20px;
-            border-radius: 10px;
-            text-align: center;
-            margin: 20px 0;
-            border: 2px solid #ffc107;
-        }
-        
-        .alert-container {
-            margin-bottom: 20px;
-            transition: opacity 0.5s ease-in-out;
-        }
-        .weather-alert {
-            padding: 15px 20px;
-            border-radius: 10px;
-            margin-bottom: 10px;
-            display: flex;
-            align-items: center;
-            gap: 15px;
-            animation: alertPulse 2s ease-in-out infinite;
-            box-shadow: 0 4px 12px rgba(0, 0, 0, 0.15);
-        }
-        .weather-alert.alert-red {
-            background: linear-gradient(135deg, #ff4757 0%, #e84118 100%);
-            color: white;
-            border: 2px solid #c23616;
-        }
-        .weather-alert.alert-orange {
-            background: linear-gradient(135deg, #ffa502 0%, #ff6348 100%);
-            color: white;
-            border: 2px solid #e17055;
-        }
-        .weather-alert.alert-yellow {
-            background: linear-gradient(135deg, #ffd700 0%, #ffb900 100%);
-            color: #333;
-            border: 2px solid #f39c12;
-        }
-        .alert-icon {
-            font-size: 2em;
-            animation: shake 0.5s ease-in-out infinite;
-        }
-        .alert-content {
-            flex: 1;
-        }
-        .alert-title {
-            font-size: 1.2em;
-            font-weight: bold;
-            margin-bottom: 5px;
-        }
-        .alert-time {
-            font-size: 0.9em;
-            opacity: 0.9;
-        }
-        @keyframes alertPulse {
-            0%, 100% { opacity: 1; }
-            50% { opacity: 0.85; }
-        }
-        @keyframes shake {
-            0%, 100% { transform: rotate(0deg); }
-            25% { transform: rotate(-5deg); }
-            75% { transform: rotate(5deg); }
-        }
-        
-        @media (max-width: 1024px) {
-            .main-container { grid-template-columns: 1fr; }
-        }
-    </style>
-    <script>
-        function updateData() {
-            fetch('/api/data')
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success) {
-                        if (data.aqi_data.has_data) {
-                            updateElement('[data-aqi]', data.aqi_data.aqi);
-                            updateElement('[data-pm25-avg]', data.aqi_data.pm25_avg);
-                            updateElement('[data-pm10-avg]', data.aqi_data.pm10_avg);
-                            updateElement('[data-pm25]', data.aqi_data.pm25);
-                            updateElement('[data-pm10]', data.aqi_data.pm10);
-                            updateElement('[data-o3]', data.aqi_data.o3);
-                            
-                            updateChange('[data-aqi-change]', data.aqi_data.aqi_change);
-                            updateChange('[data-pm25-avg-change]', data.aqi_data.pm25_avg_change);
-                            updateChange('[data-pm10-avg-change]', data.aqi_data.pm10_avg_change);
-                            updateChange('[data-pm25-change]', data.aqi_data.pm25_change);
-                            updateChange('[data-pm10-change]', data.aqi_data.pm10_change);
-                            updateChange('[data-o3-change]', data.aqi_data.o3_change);
-                            
-                            // 更新背景顏色 - 新增功能！
-                            updateCardColor('[data-aqi]', data.aqi_data.aqi_color);
-                            updateCardColor('[data-pm25-avg]', data.aqi_data.pm25_avg_color);
-                            updateCardColor('[data-pm10-avg]', data.aqi_data.pm10_avg_color);
-                            updateCardColor('[data-pm25]', data.aqi_data.pm25_color);
-                            updateCardColor('[data-pm10]', data.aqi_data.pm10_color);
-                            updateCardColor('[data-o3]', data.aqi_data.o3_color);
-                            
-                            // 更新狀態標籤 - 新增功能！
-                            updateStatus('[data-aqi]', data.aqi_data.aqi_label);
-                            updateStatus('[data-pm25-avg]', data.aqi_data.pm25_avg_label);
-                            updateStatus('[data-pm10-avg]', data.aqi_data.pm10_avg_label);
-                            updateStatus('[data-pm25]', data.aqi_data.pm25_label);
-                            updateStatus('[data-pm10]', data.aqi_data.pm10_label);
-                            updateStatus('[data-o3]', data.aqi_data.o3_label);
-                            
-                            updateElement('[data-publish-time]', data.aqi_data.publish_time);
-                        }
-                        
-                        if (data.forecast_data.has_data) {
-                            updateElement('[data-forecast-temp]', data.forecast_data.temp);
-                            updateElement('[data-forecast-feels]', data.forecast_data.feels_like);
-                            updateElement('[data-forecast-comfort]', data.forecast_data.comfort_index);
-                            updateElement('[data-forecast-comfort-desc]', data.forecast_data.comfort_desc);
-                            updateElement('[data-forecast-comfort-emoji]', data.forecast_data.comfort_emoji);
-                            updateElement('[data-forecast-humidity]', data.forecast_data.humidity);
-                            updateElement('[data-forecast-wind]', data.forecast_data.wind_display);
-                            updateElement('[data-forecast-weather]', data.forecast_data.weather_desc);
-                            updateElement('[data-forecast-pop]', data.forecast_data.pop);
-                            updateElement('[data-forecast-time]', data.forecast_data.forecast_time);
-                        }
-                        
-                        // 更新警特報（動態更新 DOM）
-                        if (data.alert_data) {
-                            const alertContainer = document.getElementById('alert-container');
-                            if (alertContainer) {
-                                if (data.alert_data.has_alert && data.alert_data.alerts.length > 0) {
-                                    // 有警報：動態生成警報 HTML
-                                    let alertsHTML = '';
-                                    data.alert_data.alerts.forEach(alert => {
-                                        alertsHTML += `
-                                            <div class="weather-alert alert-${alert.color}">
-                                                <div class="alert-icon">⚠️</div>
-                                                <div class="alert-content">
-                                                    <div class="alert-title">${alert.phenomena}${alert.significance}</div>
-                                                    <div class="alert-time">生效時間：${alert.start_time} ~ ${alert.end_time}</div>
-                                                </div>
-                                            </div>
-                                        `;
-                                    });
-                                    alertContainer.innerHTML = alertsHTML;
-                                    alertContainer.style.display = 'block';
-                                } else {
-                                    // 無警報：清空並隱藏
-                                    alertContainer.innerHTML = '';
-                                    alertContainer.style.display = 'none';
-                                }
-                            }
-                        }
-
-                        updateElement('[data-page-time]', data.page_load_time);
-                        
-                        console.log('✓ 數據更新成功', new Date().toLocaleTimeString());
-                    }
-                })
-                .catch(error => {
-                    console.error('× 更新失敗:', error);
-                });
-        }
-        
-        function updateElement(selector, value) {
-            const el = document.querySelector(selector);
-            if (el && value !== undefined && value !== null) {
-                el.textContent = value;
-            }
-        }
-        
-        function updateChange(selector, value) {
-            const el = document.querySelector(selector);
-            if (el) {
-                if (value !== null && value !== undefined && value !== '') {
-                    el.textContent = value;
-                    el.style.display = '';
-                    el.className = 'data-change';
-                    if (value.includes('↑')) el.className += ' up';
-                    else if (value.includes('↓')) el.className += ' down';
-                    else el.className += ' same';
-                } else {
-                    el.style.display = 'none';
-                }
-            }
-        }
-        
-        // 新增函數：更新卡片背景顏色
-        function updateCardColor(selector, colorClass) {
-            const el = document.querySelector(selector);
-            if (el) {
-                // 找到父層的 data-card
-                const card = el.closest('.data-card');
-                if (card) {
-                    // 移除所有顏色 class
-                    card.classList.remove('green', 'yellow', 'orange', 'red', 'gray');
-                    // 加上新的顏色 class
-                    if (colorClass) {
-                        card.classList.add(colorClass);
-                    }
-                }
-            }
-        }
-        
-        // 新增函數：更新狀態標籤文字
-        function updateStatus(selector, statusText) {
-            const el = document.querySelector(selector);
-            if (el) {
-                // 找到父層的 data-card
-                const card = el.closest('.data-card');
-                if (card) {
-                    // 找到 .data-status 元素
-                    const statusEl = card.querySelector('.data-status');
-                    if (statusEl && statusText) {
-                        statusEl.textContent = statusText;
-                    }
-                }
-            }
-        }
-        
-        setInterval(updateData, 180000);  // 每3分鐘更新一次
-        setTimeout(updateData, 10000);    // 10秒後首次自動更新
-    </script>
+    <title>{{ data.site_name }}環境監測</title>
+    <link rel="stylesheet" href="{{ assets['style.css'] }}">
+    {% if bg_image %}<link rel="stylesheet" href="{{ assets['background.css'] }}">{% endif %}
+    <script src="{{ assets['app.js'] }}" defer></script>
 </head>
-<body>
+<body{% if bg_image %} class="has-bg"{% endif %} data-api-params='{{ api_params|tojson }}'>
     <div class="main-container">
         <div class="weather-container">
             <h2>🌤️ 天氣預報</h2>
@@ -878,7 +1089,7 @@ HTML_TEMPLATE = """
                 {% endif %}
             </div>
     
-            <div class="site-info">頭份市</div>
+            <div class="site-info">{{ forecast.location_name }}</div>
             
             {% if forecast.has_data %}
             <div class="weather-desc-box"><span data-forecast-weather>{{ forecast.weather_desc }}</span></div>
@@ -1083,7 +1294,7 @@ HTML_TEMPLATE = """
                 {% if data.publish_time != 'N/A' %}
                 <div style="margin-top: 5px;">📊 環境部發布時間：<span data-publish-time>{{ data.publish_time }}</span></div>
                 {% endif %}
-                <div class="refresh-note">⏱️ 資料每3分鐘自動更新</div>
+                <div class="refresh-note">⏱️ 資料有更新時自動同步顯示</div>
             </div>
             {% else %}
             <div class="error-message">
@@ -1097,56 +1308,747 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# 頁面快取：每個(測站, 鄉鎮)每個快照版本只渲染一次，內容只取決於快照，因此各 worker 的 ETag 一致
+# page_cache 為 (測站, 鄉鎮) → (快取鍵, ETag, HTML, {編碼: 壓縮後 HTML}) 的 tuple，以單一參考替換
+page_cache = {}
+page_render_lock = Lock()
+response_cache_requests = Counter('toufen_response_cache_requests_total', '頁面 / API / 差異快取命中次數',
+                                  ('cache', 'result'))
+
+def get_snapshot_time(snapshot):
+    """快照中最新的抓取時間，作為頁面產生時間"""
+    times = [t for t in snapshot.fetched_at.values() if t is not None]
+    return max(times).strftime('%Y-%m-%d %H:%M:%S') if times else '尚未更新'
+
+def get_site_data(snapshot, site):
+    """從快照的測站索引取得 SiteReading，尚未取得資料時回傳 None"""
+    return snapshot.aqi['sites'].get(site)
+
+def get_location_data(snapshot, location):
+    """從快照的鄉鎮索引取得 ForecastReading，尚未取得資料時回傳 None"""
+    return snapshot.forecast['locations'].get(location)
+
+# 顯示格式化：數值轉文字、缺值顯示 N/A、等級轉顏色與標籤，只在渲染頁面時使用
+def format_value(value):
+    return 'N/A' if value is None else f"{value:g}"
+
+def format_time(timestamp, fmt='%Y-%m-%d %H:%M:%S'):
+    return 'N/A' if timestamp is None else datetime.fromtimestamp(timestamp, TAIPEI_TZ).strftime(fmt)
+
+def format_change(change):
+    if change is None:
+        return None
+    if change > 0:
+        return f"↑ +{change:.1f}"
+    if change < 0:
+        return f"↓ {change:.1f}"
+    return "─ 0"
+
+def format_site(reading, site):
+    """SiteReading 轉為頁面模板使用的文字欄位"""
+    if reading is None:
+        return dict(EMPTY_AQI_DATA, site_name=site)
+    data = {
+        'site_name': reading.site_name,
+        'update_time': format_time(reading.update_time),
+        'publish_time': format_time(reading.publish_time),
+        'has_data': True
+    }
+    for name in MEASUREMENTS:
+        level = reading.level(name)
+        data[name] = format_value(getattr(reading, name))
+        data[f'{name}_color'] = level.color
+        data[f'{name}_label'] = level.label
+        data[f'{name}_change'] = format_change(getattr(reading, f'{name}_change', None))
+    return data
+
+def format_forecast(reading, location):
+    """ForecastReading 轉為頁面模板使用的文字欄位"""
+    if reading is None:
+        return dict(EMPTY_FORECAST_DATA, location_name=location)
+    comfort_desc = reading.comfort_desc or '無資料'
+    comfort_emoji, comfort_color = get_comfort_emoji_color(comfort_desc)
+    # 組合風速風向顯示
+    if reading.wind_dir is not None and reading.wind_speed is not None and reading.wind_scale is not None:
+        wind_display = f"{reading.wind_dir} 平均風速{format_value(reading.wind_scale)}級(每秒{format_value(reading.wind_speed)}公尺)"
+    else:
+        wind_display = 'N/A'
+    return {
+        'location_name': reading.location_name,
+        'temp': format_value(reading.temp),
+        'feels_like': format_value(reading.feels_like),
+        'comfort_index': format_value(reading.comfort_index),
+        'comfort_desc': comfort_desc,
+        'comfort_emoji': comfort_emoji,
+        'comfort_color': comfort_color,
+        'humidity': format_value(reading.humidity),
+        'wind_display': wind_display,
+        'weather_desc': reading.weather_desc or 'N/A',
+        'pop': format_value(reading.pop),
+        'forecast_time': format_time(reading.forecast_time, '%m/%d %H:%M'),
+        'has_data': True
+    }
+
+# API 欄位：數值、epoch 秒與等級(整數)，顯示文字由前端產生
+def site_json(reading, site):
+    if reading is None:
+        return {'site_name': site, 'has_data': False}
+    data = asdict(reading)
+    for name in MEASUREMENTS:
+        data[f'{name}_level'] = int(reading.level(name))
+    data['has_data'] = True
+    return data
+
+def forecast_json(reading, location):
+    if reading is None:
+        return {'location_name': location, 'has_data': False}
+    data = asdict(reading)
+    data['has_data'] = True
+    return data
+
+def get_request_view():
+    """從 ?site= 與 ?location= 取得要顯示的 (測站, 鄉鎮)"""
+    return request.args.get('site', DEFAULT_SITE), request.args.get('location', DEFAULT_LOCATION)
+
+def find_view_error(snapshot, view):
+    """測站或鄉鎮不存在時回傳 404 回應，否則回傳 None
+    數據源尚未有成功的抓取時無從判斷，照常回應(顯示預設的暫無資料)"""
+    site, location = view
+    if (site != DEFAULT_SITE and snapshot.fetched_at['aqi'] is not None
+            and site not in snapshot.aqi['sites']):
+        return {'success': False, 'error': f"找不到測站 {site}"}, 404
+    if (location != DEFAULT_LOCATION and snapshot.fetched_at['forecast'] is not None
+            and location not in snapshot.forecast['locations']):
+        return {'success': False, 'error': f"找不到鄉鎮 {location}"}, 404
+    return None
+
+def get_view_params(view):
+    """頁面 JS 呼叫 API 時附帶的參數，預設值省略"""
+    site, location = view
+    params = {}
+    if site != DEFAULT_SITE:
+        params['site'] = site
+    if location != DEFAULT_LOCATION:
+        params['location'] = location
+    return params
+
+DEFAULT_VIEW = (DEFAULT_SITE, DEFAULT_LOCATION)
+
+# 預先壓縮：快取的頁面與 API 內容每個版本只壓縮一次，之後依 Accept-Encoding 直接送出對應版本
+# 有安裝 brotli 時優先使用 br，其次 gzip；太小的內容(例如差異更新)壓縮效益有限，直接送出
+COMPRESS_MIN_SIZE = 512
+
+def compress_body(body):
+    """回傳 {編碼: 壓縮後內容}，依偏好順序排列"""
+    if len(body) < COMPRESS_MIN_SIZE:
+        return {}
+    encoded = {}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(body, quality=11)
+    encoded['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+    return encoded
+
+def make_encoded_response(body, encoded, mimetype, etag):
+    """依 Accept-Encoding 選擇預先壓縮的內容建立回應
+    各編碼為同一內容，共用弱 ETag，條件式請求不受編碼影響"""
+    encoding = request.accept_encodings.best_match(list(encoded)) if encoded else None
+    response = Response(encoded[encoding] if encoding else body, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag, weak=True)
+    return response
+
+# 靜態資源：樣式與前端程式在啟動時讀入一次並預先壓縮
+# 網址帶有內容雜湊(例如 /static/app.1a2b3c4d5e.js)，內容變更時網址跟著改變，因此可永久快取
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_FILES = {'style.css': 'text/css', 'app.js': 'text/javascript'}
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+def add_static_asset(urls, assets, filename, body, mimetype):
+    digest = hashlib.sha256(body).hexdigest()
+    stem, ext = os.path.splitext(filename)
+    hashed = f"{stem}.{digest[:10]}{ext}"
+    urls[filename] = f"/static/{hashed}"
+    assets[hashed] = (digest[:32], body, compress_body(body), mimetype)
+
+def load_static_assets():
+    """回傳 ({檔名: 帶雜湊的網址}, {帶雜湊的檔名: (ETag, 內容, {編碼: 壓縮後內容}, MIME)})"""
+    urls, assets = {}, {}
+    for filename, mimetype in STATIC_FILES.items():
+        with open(os.path.join(STATIC_DIR, filename), 'rb') as f:
+            add_static_asset(urls, assets, filename, f.read(), mimetype)
+    return urls, assets
+
+STATIC_URLS, STATIC_ASSETS = load_static_assets()
+
+# 背景圖：啟動時讀入一次，有安裝 Pillow 時在背景執行緒另外產生較小寬度與 WebP 版本
+# 各版本網址帶有內容雜湊，可永久快取；背景 CSS 依視窗大小與像素密度選擇寬度，並以 image-set 優先使用 WebP
+BACKGROUND_WIDTHS = (640, 1280, 1920)
+BACKGROUND_QUALITY = 80
+# 不帶雜湊的 /background 為原圖，網址不變，因此只快取一天並以 ETag 驗證
+BACKGROUND_MAX_AGE = 24 * 3600
+
+def encode_image(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'WEBP':
+        image.save(buffer, fmt, quality=BACKGROUND_QUALITY)
+    else:
+        image.save(buffer, fmt, quality=BACKGROUND_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+def background_file(body, label, mimetype):
+    """回傳 (帶雜湊的檔名, (ETag, 內容, MIME))"""
+    digest = hashlib.sha256(body).hexdigest()
+    return f"{label}.{digest[:10]}{mimetypes.guess_extension(mimetype)}", (digest[:32], body, mimetype)
+
+def background_rule(names):
+    """一組 {MIME: 檔名} 的背景宣告，先寫單一 url() 給不支援 image-set 的瀏覽器"""
+    urls = {mimetype: f"/background/{name}" for mimetype, name in names.items()}
+    fallback = urls.get('image/jpeg') or next(iter(urls.values()))
+    options = ', '.join(f'url({url}) type("{mimetype}")' for mimetype, url in urls.items())
+    return f"background-image: url({fallback}); background-image: image-set({options});"
+
+def build_background_css(variants, aspect):
+    """variants 為由小到大的 [(寬度, {MIME: 檔名})]，最後一個為原圖寬度
+    cover 所需的圖寬為 max(視窗寬, 視窗高 × 寬高比) × 像素密度，較小的版本以媒體查詢覆蓋"""
+    lines = [f"body.has-bg {{ {background_rule(variants[-1][1])} }}"]
+    for width, urls in reversed(variants[:-1]):
+        queries = []
+        for density in (1, 2, 3):
+            query = f"(max-width: {width // density}px) and (max-height: {int(width / aspect) // density}px)"
+            if density < 3:
+                query += f" and (max-resolution: {density}dppx)"
+            queries.append(query)
+        lines.append(f"@media {', '.join(queries)} {{ body.has-bg {{ {background_rule(urls)} }} }}")
+    return '\n'.join(lines) + '\n'
+
+def load_background():
+    """讀入原圖，回傳 (原圖檔名, 原圖, 只使用原圖的背景 CSS)；沒有背景圖時回傳 (None, None, None)"""
+    if not os.path.exists(BACKGROUND_IMAGE):
+        return None, None, None
+    with open(BACKGROUND_IMAGE, 'rb') as f:
+        body = f.read()
+    mimetype = mimetypes.guess_type(BACKGROUND_IMAGE)[0] or 'application/octet-stream'
+    name, original = background_file(body, 'background', mimetype)
+    return name, original, build_background_css([(None, {mimetype: name})], 1)
+
+def generate_background_variants(original_name, original):
+    """以 Pillow 產生各寬度的版本，回傳 ({檔名: (ETag, 內容, MIME)}, [(寬度, {MIME: 檔名})], 寬高比)
+    原圖寬度的版本沿用原圖，另外只產生 WebP"""
+    _, body, mimetype = original
+    with Image.open(io.BytesIO(body)) as image:
+        image = image.convert('RGB')
+    formats = [('image/webp', 'WEBP')] if features.check('webp') else []
+    files = {}
+    variants = []
+    for width in [w for w in BACKGROUND_WIDTHS if w < image.width] + [image.width]:
+        resized = image if width == image.width else image.resize(
+            (width, round(image.height * width / image.width)), Image.LANCZOS)
+        names = {}
+        encodings = formats if width == image.width else formats + [('image/jpeg', 'JPEG')]
+        for variant_mimetype, fmt in encodings:
+            name, entry = background_file(encode_image(resized, fmt), f"background-{width}", variant_mimetype)
+            files[name] = entry
+            names[variant_mimetype] = name
+        if width == image.width:
+            names[mimetype] = original_name
+        variants.append((width, names))
+    return files, variants, image.width / image.height
+
+# 產生的版本依原圖雜湊快取在磁碟上，同一張圖只有第一個行程需要重新編碼；設為空字串時停用
+BACKGROUND_CACHE_DIR = os.environ.get('BACKGROUND_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'toufen-background'))
+
+def load_cached_background_variants(cache_dir):
+    """讀取磁碟快取，沒有或內容不完整時回傳 None"""
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+        files = {}
+        for name, mimetype in manifest['files'].items():
+            with open(os.path.join(cache_dir, name), 'rb') as f:
+                body = f.read()
+            files[name] = (hashlib.sha256(body).hexdigest()[:32], body, mimetype)
+        return files, [(width, names) for width, names in manifest['variants']], manifest['aspect']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def save_background_variants(cache_dir, files, variants, aspect):
+    """先寫入暫存目錄再改名，其他行程不會讀到寫一半的快取；已有其他行程寫入時捨棄"""
+    tmp_dir = None
+    try:
+        os.makedirs(BACKGROUND_CACHE_DIR, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix='.variants-', dir=BACKGROUND_CACHE_DIR)
+        for name, (_, body, _) in files.items():
+            with open(os.path.join(tmp_dir, name), 'wb') as f:
+                f.write(body)
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'aspect': aspect,
+                'variants': variants,
+                'files': {name: mimetype for name, (_, _, mimetype) in files.items()},
+            }, f)
+        os.rename(tmp_dir, cache_dir)
+        tmp_dir = None
+    except OSError as e:
+        if not os.path.isdir(cache_dir):
+            logger.warning('寫入背景圖快取失敗', extra={'error': str(e)})
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def run_in_os_thread(func, *args):
+    """在真正的 OS 執行緒執行 CPU 密集的工作並等待結果
+    gevent worker 的 Thread 是 greenlet，直接執行會阻塞事件迴圈；改用 hub 的執行緒池，等待期間其他連線照常處理"""
+    if monkey is not None and monkey.is_module_patched('threading'):
+        return get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+def prepare_background_variants():
+    """背景執行緒：載入或產生各版本，完成後加入 BACKGROUND_FILES 並替換背景 CSS
+    完成前頁面只使用原圖，啟動不需等待編碼"""
+    global BACKGROUND_FILES
+    # 快取目錄名稱包含原圖雜湊與產生設定，任一改變時重新產生
+    key = f"{BACKGROUND[0]}-q{BACKGROUND_QUALITY}-w{'-'.join(map(str, BACKGROUND_WIDTHS))}"
+    cache_dir = os.path.join(BACKGROUND_CACHE_DIR, key) if BACKGROUND_CACHE_DIR else None
+    result = load_cached_background_variants(cache_dir) if cache_dir else None
+    if result is None:
+        try:
+            result = run_in_os_thread(generate_background_variants, BACKGROUND_NAME, BACKGROUND)
+        except OSError as e:
+            logger.warning('產生背景圖版本失敗，只提供原圖', extra={'error': str(e)})
+            return
+        if cache_dir:
+            save_background_variants(cache_dir, *result)
+    files, variants, aspect = result
+    BACKGROUND_FILES = {**BACKGROUND_FILES, **files}
+    css = build_background_css(variants, aspect)
+    add_static_asset(STATIC_URLS, STATIC_ASSETS, 'background.css', css.encode('utf-8'), 'text/css')
+    logger.info('背景圖版本已就緒', extra={'files': len(files), 'cached': cache_dir is not None})
+
+BACKGROUND_NAME, BACKGROUND, background_css = load_background()
+BACKGROUND_FILES = {BACKGROUND_NAME: BACKGROUND} if BACKGROUND is not None else {}
+if background_css is not None:
+    add_static_asset(STATIC_URLS, STATIC_ASSETS, 'background.css', background_css.encode('utf-8'), 'text/css')
+    if Image is not None:
+        Thread(target=prepare_background_variants, name='background-variants', daemon=True).start()
+
+def get_rendered_page(snapshot, view=DEFAULT_VIEW):
+    bg_exists = BACKGROUND is not None
+    # 背景圖版本產生完成後背景 CSS 網址會改變，頁面需重新渲染
+    key = (snapshot.version, STATIC_URLS.get('background.css'))
+    cached = page_cache.get(view)
+    if cached is not None and cached[0] == key:
+        response_cache_requests.inc('page', 'hit')
+        return cached
+    
+    with page_render_lock:
+        cached = page_cache.get(view)
+        if cached is not None and cached[0] == key:
+            response_cache_requests.inc('page', 'hit')
+            return cached
+        response_cache_requests.inc('page', 'miss')
+        site, location = view
+        body = render_template_string(
+            HTML_TEMPLATE, 
+            data=format_site(get_site_data(snapshot, site), site),
+            forecast=format_forecast(get_location_data(snapshot, location), location),
+            alerts=snapshot.alert,
+            page_load_time=get_snapshot_time(snapshot),
+            bg_image=BACKGROUND_IMAGE if bg_exists else None,
+            api_params=get_view_params(view),
+            assets=STATIC_URLS
+        ).encode('utf-8')
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        page_cache[view] = (key, etag, body, compress_body(body))
+        return page_cache[view]
+
+# ?location=<鄉鎮> 時左側顯示該鄉鎮的預報
 @app.route('/')
 def index():
-    if should_fetch_data():
-        with fetch_lock:
-            if should_fetch_data():
-                fetch_air_quality_data()
-                fetch_weather_forecast()
-                fetch_weather_alerts()
-    
-    bg_exists = os.path.exists(BACKGROUND_IMAGE)
-    page_load_time = get_taipei_time().strftime('%Y-%m-%d %H:%M:%S')
+    return render_view_page((DEFAULT_SITE, get_request_view()[1]))
+
+# 單一測站頁面，與首頁共用同一次全測站下載的數據
+@app.route('/site/<name>')
+def site_page(name):
+    return render_view_page((name, get_request_view()[1]))
+
+def render_view_page(view):
+    snapshot = get_snapshot()
+    error = find_view_error(snapshot, view)
+    if error:
+        return error
+    _, etag, body, encoded = get_rendered_page(snapshot, view)
+    response = make_encoded_response(body, encoded, 'text/html', etag)
+    # 瀏覽器每次都需重新驗證，未變更時回傳 304
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+# API 快取：每個(測站, 鄉鎮)每個快照版本只序列化一次，並保留最近幾個版本的內容以計算差異
+# api_cache 為 (測站, 鄉鎮) → (版本, ETag, JSON bytes, {編碼: 壓縮後內容}) 的 tuple，以單一參考替換
+API_HISTORY_SIZE = 16
+API_SECTIONS = ('aqi_data', 'forecast_data', 'alert_data')
+api_cache = {}
+api_history = {}
+api_delta_cache = {}
+api_cache_lock = Lock()
+
+def dump_json_bytes(payload):
+    return json.dumps(payload, default=json_default, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+def get_api_payload(snapshot, view=DEFAULT_VIEW):
+    cached = api_cache.get(view)
+    if cached is not None and cached[0] == snapshot.version:
+        response_cache_requests.inc('api', 'hit')
+        return cached
     
-    return render_template_string(
-        HTML_TEMPLATE, 
-        data=latest_data,
-        forecast=forecast_data,
-        alerts=alert_data,
-        page_load_time=page_load_time,
-        bg_image=BACKGROUND_IMAGE if bg_exists else None
-    )
+    with api_cache_lock:
+        cached = api_cache.get(view)
+        if cached is not None and cached[0] == snapshot.version:
+            response_cache_requests.inc('api', 'hit')
+            return cached
+        response_cache_requests.inc('api', 'miss')
+        site, location = view
+        body = dump_json_bytes({
+            'success': True,
+            'version': snapshot.version,
+            'aqi_data': site_json(get_site_data(snapshot, site), site),
+            'forecast_data': forecast_json(get_location_data(snapshot, location), location),
+            'alert_data': snapshot.alert,
+            'page_load_time': get_snapshot_time(snapshot)
+        })
+        history = api_history.setdefault(view, OrderedDict())
+        history[snapshot.version] = json.loads(body)
+        while len(history) > API_HISTORY_SIZE:
+            history.popitem(last=False)
+        api_delta_cache[view] = {}
+        api_cache[view] = (snapshot.version, hashlib.sha256(body).hexdigest()[:32], body, compress_body(body))
+        return api_cache[view]
+
+def get_api_delta(since, version, view=DEFAULT_VIEW):
+    """計算從 since 版本到目前版本有變更的欄位，回傳 (JSON bytes, {編碼: 壓縮後內容})
+    since 不在保留範圍內時回傳 None"""
+    with api_cache_lock:
+        delta = api_delta_cache.get(view, {}).get((since, version))
+        if delta is not None:
+            response_cache_requests.inc('delta', 'hit')
+            return delta
+        response_cache_requests.inc('delta', 'miss')
+        history = api_history.get(view, {})
+        old, new = history.get(since), history.get(version)
+        if old is None or new is None:
+            return None
+        changes = {}
+        for section in API_SECTIONS:
+            old_section, new_section = old[section], new[section]
+            diff = {k: v for k, v in new_section.items() if k not in old_section or old_section[k] != v}
+            diff.update({k: None for k in old_section if k not in new_section})
+            if diff:
+                changes[section] = diff
+        body = dump_json_bytes({
+            'success': True,
+            'delta': True,
+            'since': since,
+            'version': version,
+            'changes': changes,
+            'page_load_time': new['page_load_time']
+        })
+        delta = (body, compress_body(body))
+        api_delta_cache.setdefault(view, {})[(since, version)] = delta
+        return delta
 
+# 回傳目前版本數據；If-None-Match 相符時回傳 304
+# ?since=<版本> 時只回傳自該版本後變更的欄位
+# ?site=<測站> 與 ?location=<鄉鎮> 選擇空品測站與預報鄉鎮，都由記憶體中的全區數據提供
 @app.route('/api/data')
 def api_data():
-    if should_fetch_data():
-        with fetch_lock:
-            if should_fetch_data():
-                fetch_air_quality_data()
-                fetch_weather_forecast()
-                fetch_weather_alerts()
+    snapshot = get_snapshot()
+    view = get_request_view()
+    error = find_view_error(snapshot, view)
+    if error:
+        return error
+    version, etag, body, encoded = get_api_payload(snapshot, view)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag, weak=True)
+    else:
+        since = request.args.get('since', type=int)
+        delta = get_api_delta(since, version, view) if since is not None and since != version else None
+        if delta is not None:
+            body, encoded = delta
+        response = make_encoded_response(body, encoded, 'application/json', etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# 推送連線設定(秒)：心跳間隔，以及單一連線最長保持時間(到期後由瀏覽器自動重新連線)
+SSE_HEARTBEAT_SECONDS = int(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+SSE_MAX_STREAM_SECONDS = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 600))
+
+# Server-Sent Events：快照更新時立即推送給所有連線中的頁面
+# 第一次推送完整數據，之後推送差異；重新連線時依 Last-Event-ID 補送差異
+@app.route('/api/stream')
+def api_stream():
+    last_version = request.headers.get('Last-Event-ID', type=int)
+    view = get_request_view()
+    error = find_view_error(current_snapshot, view)
+    if error:
+        return error
+    
+    def events():
+        sent_version = last_version
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        yield b'retry: 10000\n\n'
+        while time.monotonic() < deadline:
+            snapshot = current_snapshot
+            if snapshot.version != sent_version:
+                version, _, body, _ = get_api_payload(snapshot, view)
+                delta = get_api_delta(sent_version, version, view) if sent_version is not None else None
+                yield b'id: %d\nevent: snapshot\ndata: %s\n\n' % (version, delta[0] if delta else body)
+                sent_version = version
+            with snapshot_changed:
+                changed = snapshot_changed.wait_for(
+                    lambda: current_snapshot.version != sent_version, timeout=SSE_HEARTBEAT_SECONDS
+                )
+            if not changed:
+                yield b': keep-alive\n\n'
+    
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# 測站清單：依縣市分組，?county=<縣市> 時只回傳該縣市的測站
+@app.route('/api/sites')
+def api_sites():
+    snapshot = get_snapshot()
+    counties = snapshot.aqi['counties']
+    county = request.args.get('county')
+    if county is not None:
+        if county not in counties:
+            return {'success': False, 'error': f"找不到縣市 {county}"}, 404
+        counties = {county: counties[county]}
+    sites = snapshot.aqi['sites']
+    return {
+        'success': True,
+        'counties': {
+            name: [
+                {
+                    'site_name': site,
+                    'aqi': sites[site].aqi,
+                    'aqi_level': int(sites[site].level('aqi')),
+                    'publish_time': sites[site].publish_time
+                }
+                for site in names
+            ]
+            for name, names in counties.items()
+        }
+    }
+
+# 預報鄉鎮清單
+@app.route('/api/locations')
+def api_locations():
+    locations = get_snapshot().forecast['locations']
+    return {
+        'success': True,
+        'locations': [
+            {
+                'location_name': name,
+                'temp': data.temp,
+                'weather_desc': data.weather_desc,
+                'forecast_time': data.forecast_time
+            }
+            for name, data in locations.items()
+        ]
+    }
+
+# 鄉鎮逐時預報，由快照中的時間軸查詢，不重新解析上游數據
+# /api/forecast?location=竹南鎮 回傳 72 小時序列；加上 at=2026-01-01T09:00 回傳該小時的預報
+FORECAST_SERIES_HOURS = 72
+
+@app.route('/api/forecast')
+def api_forecast():
+    location = request.args.get('location', DEFAULT_LOCATION)
+    columns = get_snapshot().forecast.get('timelines', {}).get(location)
+    if columns is None:
+        return {'success': False, 'error': f"找不到鄉鎮 {location}"}, 404
+    timeline = ForecastTimeline(columns)
+    
+    at = request.args.get('at')
+    if at is not None:
+        try:
+            at_time = datetime.fromisoformat(at)
+        except ValueError:
+            return {'success': False, 'error': 'at 須為 ISO 8601 時間，例如 2026-01-01T09:00'}, 400
+        if at_time.tzinfo is None:
+            at_time = at_time.replace(tzinfo=TAIPEI_TZ)
+        return {
+            'success': True,
+            'location': location,
+            'time': at_time.astimezone(TAIPEI_TZ).strftime('%Y-%m-%d %H:%M'),
+            'forecast': timeline.at(int(at_time.timestamp()))
+        }
     
+    times, values = timeline.series(hours=FORECAST_SERIES_HOURS)
+    result = {
+        'success': True,
+        'location': location,
+        'times': [datetime.fromtimestamp(t, TAIPEI_TZ).strftime('%Y-%m-%d %H:%M') for t in times],
+    }
+    for field in FIELD_NAMES:
+        result[field] = values[field]
+    return result
+
+HISTORY_RANGES = {'24h': timedelta(hours=24), '7d': timedelta(days=7), '30d': timedelta(days=30)}
+
+# 逐時測項歷史，只讀取本機儲存
+# /api/history?pollutant=PM2.5&range=24h|7d|30d
+@app.route('/api/history')
+def api_hourly_history():
+    pollutant = request.args.get('pollutant', 'PM2.5')
+    range_name = request.args.get('range', '24h')
+    name = next((p for p in POLLUTANTS if p.lower() == pollutant.lower()), None)
+    if name is None or range_name not in HISTORY_RANGES:
+        return {
+            'success': False,
+            'error': f"pollutant 須為 {', '.join(POLLUTANTS)}，range 須為 {', '.join(HISTORY_RANGES)}"
+        }, 400
+    
+    since = int((get_taipei_time() - HISTORY_RANGES[range_name]).timestamp())
+    times, values = hourly_history.query(name, since)
     return {
         'success': True,
-        'aqi_data': latest_data,
-        'forecast_data': forecast_data,
-        'alert_data': alert_data,
-        'page_load_time': get_taipei_time().strftime('%Y-%m-%d %H:%M:%S')
+        'pollutant': name,
+        'range': range_name,
+        'times': [datetime.fromtimestamp(t, TAIPEI_TZ).strftime('%Y-%m-%d %H:%M') for t in times],
+        'values': [round(v, 2) for v in values]
     }
 
+def stat_value(value, digits=2):
+    """統計值轉為 JSON 數值，NaN(資料不足)轉為 null"""
+    value = float(value)
+    return None if math.isnan(value) else round(value, digits)
+
+# 逐時測項統計：8/12/24 小時平均、PM2.5/PM10 移動平均與副指標
+# /api/stats 回傳最新整點各測項統計與 AQI；加上 pollutant 與 range 則回傳該測項的統計序列
+@app.route('/api/stats')
+def api_stats():
+    # 其他 worker 寫入的新資料在這裡增量納入
+    hourly_analytics.update()
+    pollutant = request.args.get('pollutant')
+    if pollutant is None:
+        latest_time, aqi, stats = hourly_analytics.latest()
+        return {
+            'success': True,
+            'time': datetime.fromtimestamp(latest_time, TAIPEI_TZ).strftime('%Y-%m-%d %H:%M') if latest_time else None,
+            'aqi': None if latest_time is None else stat_value(aqi, 0),
+            'pollutants': {
+                name: {stat: stat_value(value) for stat, value in values.items()}
+                for name, values in stats.items()
+            }
+        }
+    
+    range_name = request.args.get('range', '24h')
+    name = next((p for p in POLLUTANTS if p.lower() == pollutant.lower()), None)
+    if name is None or range_name not in HISTORY_RANGES:
+        return {
+            'success': False,
+            'error': f"pollutant 須為 {', '.join(POLLUTANTS)}，range 須為 {', '.join(HISTORY_RANGES)}"
+        }, 400
+    
+    since = int((get_taipei_time() - HISTORY_RANGES[range_name]).timestamp())
+    times, stats = hourly_analytics.query(name, since)
+    result = {
+        'success': True,
+        'pollutant': name,
+        'range': range_name,
+        'times': [datetime.fromtimestamp(int(t), TAIPEI_TZ).strftime('%Y-%m-%d %H:%M') for t in times],
+    }
+    for stat in STAT_NAMES:
+        result[stat] = [stat_value(v) for v in stats[stat]]
+    return result
+
+# 部署後仍開著上一版頁面的瀏覽器會以舊的雜湊網址請求，檔名主體與副檔名相同時改送目前版本
+# 內容與網址的雜湊不符，這類回應不可永久快取，每次重新驗證
+def split_hashed_name(name):
+    """將 stem.雜湊10碼.ext 拆為 (stem, .ext)，格式不符時回傳 None"""
+    stem, _, rest = name.partition('.')
+    digest, dot, ext = rest.partition('.')
+    if not stem or not dot or len(digest) != 10:
+        return None
+    return stem, '.' + ext
+
+@app.route('/static/<name>')
+def static_asset(name):
+    asset = STATIC_ASSETS.get(name)
+    cache_control = f'public, max-age={STATIC_MAX_AGE}, immutable'
+    if asset is None:
+        parts = split_hashed_name(name)
+        current = STATIC_URLS.get(''.join(parts)) if parts else None
+        if current is None:
+            return "", 404
+        asset = STATIC_ASSETS[current.rsplit('/', 1)[1]]
+        cache_control = 'no-cache'
+    etag, body, encoded, mimetype = asset
+    response = make_encoded_response(body, encoded, mimetype, etag)
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
+def make_image_response(image, max_age, immutable=False):
+    """記憶體中的圖片回應：強 ETag、支援 Range 續傳"""
+    etag, body, mimetype = image
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={max_age}' + (', immutable' if immutable else '')
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(body))
+
 @app.route('/background')
 def background():
-    if os.path.exists(BACKGROUND_IMAGE):
-        directory = os.path.dirname(os.path.abspath(BACKGROUND_IMAGE)) or '.'
-        filename = os.path.basename(BACKGROUND_IMAGE)
-        return send_from_directory(directory, filename)
-    return "", 404
+    if BACKGROUND is None:
+        return "", 404
+    return make_image_response(BACKGROUND, BACKGROUND_MAX_AGE)
+
+@app.route('/background/<name>')
+def background_variant(name):
+    image = BACKGROUND_FILES.get(name)
+    if image is None:
+        parts = split_hashed_name(name)
+        current = next((n for n in BACKGROUND_FILES if parts and split_hashed_name(n) == parts), None)
+        if current is None:
+            return "", 404
+        return make_image_response(BACKGROUND_FILES[current], 0)
+    return make_image_response(image, STATIC_MAX_AGE, immutable=True)
+
+# 各路由的處理耗時；/api/stream 為開始推送前的耗時，不含連線保持時間
+request_latency = Histogram('toufen_http_request_duration_seconds', '各路由處理耗時',
+                            ('route', 'method', 'status'),
+                            (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe(route, request.method, str(response.status_code), value=time.perf_counter() - start)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    response = Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 
-fetch_air_quality_data()
-fetch_weather_forecast()
-fetch_weather_alerts()
+# 啟動時只讀取本機共用快照與磁碟快照，不等待上游 API
+sync_from_shared_store()
+restore_persisted_snapshot()
+if BLOCKING_STARTUP:
+    refresh_data()
+start_background_refresher()
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,120 @@
+"""推送連線容量測試：同時開啟大量 /api/stream 連線並保持閒置，
+期間持續量測 /api/data 的回應時間，確認閒置連線不會拖慢一般請求。
+
+--pid 指定 worker 行程時，期間每 0.5 秒讀取 /proc/<pid>/status 的 VmRSS，輸出最大值(僅限 Linux)。
+
+用法：
+    gunicorn -c gunicorn.conf.py app:app --bind 127.0.0.1:8000
+    python bench_sse.py --url http://127.0.0.1:8000 --connections 5000 --hold 30 --pid <worker PID>
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def open_stream(host, port, path, opened, first_event_times, alive, hold_until):
+    start = time.monotonic()
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        return
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+    await writer.drain()
+    opened.append(1)
+    got_event = False
+    try:
+        while time.monotonic() < hold_until:
+            line = await asyncio.wait_for(reader.readline(), timeout=max(hold_until - time.monotonic(), 0.01))
+            if not line:
+                return
+            if not got_event and line.startswith(b'event: snapshot'):
+                first_event_times.append(time.monotonic() - start)
+                got_event = True
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        if time.monotonic() >= hold_until:
+            alive.append(1)
+        writer.close()
+
+
+async def probe(host, port, hold_until, latencies):
+    """保持連線期間每 0.2 秒請求一次 /api/data"""
+    while time.monotonic() < hold_until:
+        start = time.monotonic()
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(f"GET /api/data HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+            await reader.read()
+            writer.close()
+            latencies.append(time.monotonic() - start)
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+
+
+def read_rss(pid):
+    """回傳行程的常駐記憶體(bytes)，讀取失敗時回傳 None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+async def sample_rss(pid, hold_until, samples):
+    while time.monotonic() < hold_until:
+        rss = read_rss(pid)
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(0.5)
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def main(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    opened, first_event_times, alive, latencies, rss_samples = [], [], [], [], []
+    hold_until = time.monotonic() + args.ramp + args.hold
+
+    tasks = [asyncio.create_task(probe(host, port, hold_until, latencies))]
+    if args.pid:
+        tasks.append(asyncio.create_task(sample_rss(args.pid, hold_until, rss_samples)))
+    for i in range(args.connections):
+        tasks.append(asyncio.create_task(
+            open_stream(host, port, '/api/stream', opened, first_event_times, alive, hold_until)
+        ))
+        # 在 ramp 秒內平均開啟所有連線
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.connections)
+    await asyncio.gather(*tasks)
+
+    print(f"連線數: 要求 {args.connections}, 建立 {len(opened)}, 收到首筆推送 {len(first_event_times)}, 保持到結束 {len(alive)}")
+    if first_event_times:
+        print(f"首筆推送延遲: p50 {statistics.median(first_event_times) * 1000:.1f} ms, p99 {percentile(first_event_times, 99) * 1000:.1f} ms")
+    if latencies:
+        print(f"/api/data 回應時間({len(latencies)} 次): p50 {statistics.median(latencies) * 1000:.1f} ms, p99 {percentile(latencies, 99) * 1000:.1f} ms")
+    if rss_samples:
+        print(f"worker RSS: 開始 {rss_samples[0] / 2**20:.0f} MB, 最大 {max(rss_samples) / 2**20:.0f} MB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='推送連線容量測試')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--connections', type=int, default=2000)
+    parser.add_argument('--ramp', type=float, default=5, help='開啟所有連線所用的秒數')
+    parser.add_argument('--hold', type=float, default=20, help='所有連線開啟後保持的秒數')
+    parser.add_argument('--pid', type=int, help='取樣常駐記憶體的 worker 行程 PID')
+    asyncio.run(main(parser.parse_args()))
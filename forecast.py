@@ -0,0 +1,110 @@
+# 鄉鎮預報的欄式時間軸：每次抓取時只解析一次
+# 每個氣象要素各有一組排序的起訖時間陣列與各欄位的數值陣列，以二分搜尋查詢任一小時
+# 逐時要素(溫度等)與 3 小時要素(降雨機率、天氣現象)各自依自己的時間區間查詢
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+from models import to_float
+
+HOUR = 3600
+
+# 使用的氣象要素：要素名稱 → {上游欄位: 輸出欄位}
+FORECAST_FIELDS = {
+    '溫度': {'Temperature': 'temp'},
+    '體感溫度': {'ApparentTemperature': 'feels_like'},
+    '舒適度指數': {'ComfortIndex': 'comfort_index', 'ComfortIndexDescription': 'comfort_desc'},
+    '相對濕度': {'RelativeHumidity': 'humidity'},
+    '風速': {'WindSpeed': 'wind_speed', 'BeaufortScale': 'wind_scale'},
+    '風向': {'WindDirection': 'wind_dir'},
+    '天氣現象': {'Weather': 'weather_desc'},
+    '3小時降雨機率': {'ProbabilityOfPrecipitation': 'pop'},
+}
+FIELD_NAMES = tuple(field for fields in FORECAST_FIELDS.values() for field in fields.values())
+# 以文字保存的欄位，其餘轉為數值
+TEXT_FIELDS = {'comfort_desc', 'wind_dir', 'weather_desc'}
+
+
+def parse_time(value):
+    """ISO 8601 時間字串轉為 epoch 秒，無法解析時回傳 None"""
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def build_columns(weather_elements):
+    """將上游的 WeatherElement 清單轉為 {要素: {'start': [...], 'end': [...], 欄位: [...]}}"""
+    columns = {}
+    for element in weather_elements:
+        fields = FORECAST_FIELDS.get(element.get('ElementName'))
+        if fields is None:
+            continue
+        rows = []
+        for entry in element.get('Time', []):
+            start = parse_time(entry.get('DataTime') or entry.get('StartTime'))
+            if start is None:
+                continue
+            values = (entry.get('ElementValue') or [{}])[0]
+            row = [
+                values.get(key) if field in TEXT_FIELDS else to_float(values.get(key))
+                for key, field in fields.items()
+            ]
+            rows.append((start, parse_time(entry.get('EndTime')), row))
+        if not rows:
+            continue
+        rows.sort(key=lambda row: row[0])
+        column = {'start': [row[0] for row in rows], 'end': []}
+        # 逐時要素沒有結束時間，有效到下一筆的時間(最後一筆為一小時)
+        for i, (start, end, _) in enumerate(rows):
+            if end is None:
+                end = rows[i + 1][0] if i + 1 < len(rows) else start + HOUR
+            column['end'].append(end)
+        for j, field in enumerate(fields.values()):
+            column[field] = [row[2][j] for row in rows]
+        columns[element['ElementName']] = column
+    return columns
+
+
+class ForecastTimeline:
+    """包裝 build_columns() 的結果(可為快照中的唯讀版本)提供查詢"""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def lookup(self, element, timestamp):
+        """要素在 timestamp 所在時間區間的索引，沒有涵蓋時回傳 None"""
+        column = self.columns.get(element)
+        if column is None:
+            return None
+        index = bisect_right(column['start'], timestamp) - 1
+        if index < 0 or timestamp >= column['end'][index]:
+            return None
+        return index
+
+    def at(self, timestamp):
+        """timestamp 當下各欄位的預報值，沒有涵蓋的欄位為 None"""
+        result = dict.fromkeys(FIELD_NAMES)
+        for element, fields in FORECAST_FIELDS.items():
+            index = self.lookup(element, timestamp)
+            if index is not None:
+                for field in fields.values():
+                    result[field] = self.columns[element][field][index]
+        return result
+
+    def hours(self, element='溫度'):
+        """逐時要素的所有預報時間"""
+        column = self.columns.get(element)
+        return list(column['start']) if column else []
+
+    def series(self, since=None, hours=None):
+        """從 since 起(預設為第一筆) hours 小時內每小時的預報，回傳 (時間清單, {欄位: 數值清單})"""
+        times = self.hours()
+        if since is not None:
+            times = times[bisect_left(times, since):]
+        if hours is not None and times:
+            times = times[:bisect_left(times, times[0] + hours * HOUR)]
+        result = {field: [] for field in FIELD_NAMES}
+        for timestamp in times:
+            for field, value in self.at(timestamp).items():
+                result[field].append(value)
+        return times, result
@@ -0,0 +1,17 @@
+# gunicorn 設定：預設使用 gevent 協作式 worker，單一行程可同時保持數千個閒置的推送連線(/api/stream)
+# 與慢速下載(/background)，不會因為每個連線佔用一個 worker 或執行緒而耗盡
+# WORKER_CLASS=gthread 或 sync 可改回執行緒 / 同步模式
+import os
+from importlib.util import find_spec
+
+worker_class = os.environ.get('WORKER_CLASS', 'gevent' if find_spec('gevent') else 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# gevent：每個 worker 可同時處理的連線數
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 10000))
+# gthread：每個 worker 的執行緒數(每個推送連線佔用一個執行緒)
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+timeout = 30
+# 推送連線會定期送出心跳，keep-alive 只影響一般請求
+keepalive = 5
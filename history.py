@@ -0,0 +1,91 @@
+# 頭份測站逐時測項的本機時間序列儲存
+# 記憶體中每個測項各有一組時間 / 數值陣列；磁碟上為只會附加的固定長度二進位紀錄
+# 其他 worker 查詢時只讀取檔案新增的部分，不需要呼叫上游 API
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from threading import Lock
+
+# 每筆紀錄：時間(epoch 秒)、測項編號、濃度
+RECORD = struct.Struct('<qBf')
+
+# 測項編號寫入檔案，只能在最後新增
+POLLUTANTS = ('PM2.5', 'PM10', 'Ozone', 'CO', 'SO2', 'NO2')
+
+
+class HourlyHistory:
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.times = {name: array('q') for name in POLLUTANTS}
+        self.values = {name: array('f') for name in POLLUTANTS}
+        self.offset = 0
+        with self.lock:
+            self._load_new_records()
+
+    def _load_new_records(self):
+        """讀取檔案中尚未載入的完整紀錄(其他行程可能已附加新資料)"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        end = size - (size - self.offset) % RECORD.size
+        if end <= self.offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(end - self.offset)
+        for timestamp, index, value in RECORD.iter_unpack(data):
+            if index < len(POLLUTANTS):
+                self._append(POLLUTANTS[index], timestamp, value)
+        self.offset = end
+
+    def _append(self, name, timestamp, value):
+        times = self.times[name]
+        if times and timestamp <= times[-1]:
+            return False
+        times.append(timestamp)
+        self.values[name].append(value)
+        return True
+
+    def append_readings(self, readings):
+        """附加 (時間, 測項, 濃度) 紀錄，只接受比已儲存資料更新的時間點，回傳新增筆數"""
+        with self.lock:
+            self._load_new_records()
+            packed = []
+            for timestamp, name, value in sorted(readings):
+                if name in POLLUTANTS and self._append(name, timestamp, value):
+                    packed.append(RECORD.pack(timestamp, POLLUTANTS.index(name), value))
+            if packed and self.path:
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, b''.join(packed))
+                finally:
+                    os.close(fd)
+                self.offset += len(packed) * RECORD.size
+            return len(packed)
+
+    def query(self, name, since):
+        """回傳 since(epoch 秒)之後的時間與濃度陣列"""
+        with self.lock:
+            self._load_new_records()
+            times = self.times[name]
+            start = bisect_left(times, since)
+            return times[start:], self.values[name][start:]
+
+    def latest_time(self):
+        """所有測項中最新的時間點(epoch 秒)，沒有資料時回傳 None"""
+        with self.lock:
+            self._load_new_records()
+            return max((times[-1] for times in self.times.values() if times), default=None)
+
+    def values_at(self, timestamp):
+        """回傳指定時間點各測項的濃度 {測項: 濃度}"""
+        with self.lock:
+            self._load_new_records()
+            result = {}
+            for name, times in self.times.items():
+                index = bisect_left(times, timestamp)
+                if index < len(times) and times[index] == timestamp:
+                    result[name] = self.values[name][index]
+            return result
@@ -0,0 +1,53 @@
+# 非同步的結構化記錄：呼叫端只把紀錄放入佇列，訊息格式化與寫入 stdout 都在背景 listener 執行緒進行
+# 持有 fetch_lock 或處理請求時記錄不會因 stdout 阻塞而延長等待時間
+# 每筆紀錄輸出為一行 JSON，logger.info(訊息, extra={欄位: 值}) 的 extra 欄位直接成為 JSON 欄位
+import atexit
+import json
+import logging
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# LogRecord 內建的屬性，其餘屬性視為 extra 欄位
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler 預設會在呼叫端先格式化訊息與例外堆疊，這裡原樣放入佇列，全部交給 listener"""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(name, level):
+    """設定 name 的 logger 只寫入佇列，並啟動寫出到 stdout 的 listener，回傳 logger"""
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    if logger.handlers:
+        return logger
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    # 結束時寫出佇列中剩餘的紀錄
+    atexit.register(listener.stop)
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    return logger
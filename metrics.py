@@ -0,0 +1,111 @@
+# 行程內的 Prometheus 指標：計數器、量表與直方圖，render() 輸出 /metrics 的文字格式
+# 多 worker 時每個行程各自計數，每次抓取只會看到處理該請求的 worker
+import math
+from bisect import bisect_left
+from threading import Lock
+
+# 所有已建立的指標，依建立順序輸出
+REGISTRY = []
+
+
+def format_float(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Metric:
+    """以標籤值 tuple 為鍵保存數值；標籤值依建立時的 labels 順序傳入"""
+    type = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def format_labels(self, values, extra=()):
+        pairs = [*zip(self.labels, values), *extra]
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in pairs) + '}'
+
+    def samples(self):
+        """回傳 [(名稱後綴, 標籤字串, 數值)]"""
+        with self.lock:
+            items = sorted(self.values.items())
+        return [('', self.format_labels(labels), value) for labels, value in items]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{labels} {format_float(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """collect() 回傳 {標籤值: 數值} 時於輸出當下計算，不需要另外更新"""
+    type = 'gauge'
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, *labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+    def samples(self):
+        if self.collect is None:
+            return super().samples()
+        return [('', self.format_labels(labels), value) for labels, value in sorted(self.collect().items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, *labels, value):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                # 各區間(非累積)的筆數、總和
+                entry = self.values[labels] = [[0] * len(self.buckets), 0.0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self.values.items())
+        result = []
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                result.append(('_bucket', self.format_labels(labels, [('le', format_float(bound))]), cumulative))
+            result.append(('_sum', self.format_labels(labels), total))
+            result.append(('_count', self.format_labels(labels), cumulative))
+        return result
+
+
+def render():
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
@@ -0,0 +1,100 @@
+# 快照中的數據紀錄：數值為 float、等級為列舉、缺值為 None
+# 顏色、標籤、變化箭頭等顯示用文字只在渲染頁面與前端 JS 時產生
+from bisect import bisect_left
+from dataclasses import dataclass, fields
+from enum import IntEnum
+
+
+class Level(IntEnum):
+    """空氣品質等級"""
+    UNKNOWN = 0
+    GOOD = 1
+    MODERATE = 2
+    UNHEALTHY_FOR_SENSITIVE = 3
+    UNHEALTHY = 4
+
+    @property
+    def color(self):
+        return LEVEL_COLORS[self]
+
+    @property
+    def label(self):
+        return LEVEL_LABELS[self]
+
+
+LEVEL_COLORS = ('gray', 'green', 'yellow', 'orange', 'red')
+LEVEL_LABELS = ('無資料', '良好', '普通', '對敏感族群不健康', '不健康')
+
+# 頁面顯示的測項與等級門檻(各級上限，含)
+MEASUREMENTS = ('aqi', 'pm25_avg', 'pm10_avg', 'pm25', 'pm10', 'o3')
+LEVEL_THRESHOLDS = {
+    'aqi': (50, 100, 150),
+    'pm25_avg': (15.4, 35.4, 54.4),
+    'pm10_avg': (54, 125, 254),
+    'pm25': (15.4, 35.4, 54.4),
+    'pm10': (54, 125, 254),
+    'o3': (54, 70, 85),
+}
+
+
+def to_float(value):
+    """上游字串轉為數值，空字串、'-' 等無法解析的值回傳 None"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Record:
+    """以欄位順序的 tuple 序列化(寫入共用快照與磁碟快照)"""
+    __slots__ = ()
+
+    def to_row(self):
+        return tuple(getattr(self, f.name) for f in fields(self))
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+
+@dataclass(frozen=True, slots=True)
+class SiteReading(Record):
+    """單一測站的即時觀測；*_change 為與前一小時的差值(只有預設測站有逐時歷史)"""
+    site_name: str
+    county: str
+    publish_time: int | None
+    update_time: int
+    aqi: float | None = None
+    pm25_avg: float | None = None
+    pm10_avg: float | None = None
+    pm25: float | None = None
+    pm10: float | None = None
+    o3: float | None = None
+    pm25_avg_change: float | None = None
+    pm10_avg_change: float | None = None
+    pm25_change: float | None = None
+    pm10_change: float | None = None
+    o3_change: float | None = None
+
+    def level(self, name):
+        value = getattr(self, name)
+        if value is None:
+            return Level.UNKNOWN
+        return Level(bisect_left(LEVEL_THRESHOLDS[name], value) + 1)
+
+
+@dataclass(frozen=True, slots=True)
+class ForecastReading(Record):
+    """單一鄉鎮某一小時的預報"""
+    location_name: str
+    forecast_time: int
+    temp: float | None = None
+    feels_like: float | None = None
+    comfort_index: float | None = None
+    comfort_desc: str | None = None
+    humidity: float | None = None
+    wind_speed: float | None = None
+    wind_scale: float | None = None
+    wind_dir: str | None = None
+    weather_desc: str | None = None
+    pop: float | None = None
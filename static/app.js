@@ -0,0 +1,222 @@
+// 已套用的完整數據與其版本；之後只向伺服器要求變更的欄位
+let apiState = null;
+let apiVersion = null;
+let apiETag = null;
+// 目前頁面的測站與預報鄉鎮(預設值不帶參數)，API 與推送連線都帶上相同參數
+const apiParams = JSON.parse(document.body.dataset.apiParams);
+
+function apiUrl(path, extra) {
+    const query = new URLSearchParams(Object.assign({}, apiParams, extra)).toString();
+    return query ? `${path}?${query}` : path;
+}
+
+function formatTaipeiTime(date) {
+    return date.toLocaleString('sv-SE', { timeZone: 'Asia/Taipei' });
+}
+
+function formatTaipeiNow() {
+    return formatTaipeiTime(new Date());
+}
+
+// API 只提供數值、epoch 秒與等級，顯示文字在這裡產生
+const LEVEL_COLORS = ['gray', 'green', 'yellow', 'orange', 'red'];
+const LEVEL_LABELS = ['無資料', '良好', '普通', '對敏感族群不健康', '不健康'];
+// 測項欄位 → 頁面 data 屬性名稱
+const MEASUREMENTS = { aqi: 'aqi', pm25_avg: 'pm25-avg', pm10_avg: 'pm10-avg', pm25: 'pm25', pm10: 'pm10', o3: 'o3' };
+
+function formatValue(value) {
+    return value === null || value === undefined ? 'N/A' : String(value);
+}
+
+function formatTimestamp(timestamp) {
+    return timestamp === null || timestamp === undefined ? 'N/A' : formatTaipeiTime(new Date(timestamp * 1000));
+}
+
+function formatChange(change) {
+    if (change === null || change === undefined) return null;
+    if (change > 0) return `↑ +${change.toFixed(1)}`;
+    if (change < 0) return `↓ ${change.toFixed(1)}`;
+    return '─ 0';
+}
+
+function formatWind(forecast) {
+    if (forecast.wind_dir === null || forecast.wind_speed === null || forecast.wind_scale === null) return 'N/A';
+    return `${forecast.wind_dir} 平均風速${forecast.wind_scale}級(每秒${forecast.wind_speed}公尺)`;
+}
+
+function comfortEmoji(desc) {
+    desc = desc || '';
+    if (desc.includes('舒適') || desc.toLowerCase().includes('comfortable')) return '😊';
+    if (desc.includes('悶熱') || desc.includes('悶')) return '😓';
+    if (desc.includes('易中暑') || desc.includes('炎熱')) return '🥵';
+    if (desc.includes('寒冷') || desc.includes('冷')) return '🥶';
+    return '😐';
+}
+
+// 將差異更新合併到目前數據
+function applyDelta(data) {
+    if (!data.success) return data;
+    if (data.delta && apiState) {
+        Object.entries(data.changes).forEach(([section, fields]) => {
+            Object.assign(apiState[section], fields);
+        });
+    } else {
+        apiState = data;
+    }
+    apiVersion = data.version;
+    return apiState;
+}
+
+function updateData() {
+    const url = apiVersion === null ? apiUrl('/api/data') : apiUrl('/api/data', { since: apiVersion });
+    const headers = apiETag ? { 'If-None-Match': apiETag } : {};
+    fetch(url, { headers: headers, cache: 'no-store' })
+        .then(response => {
+            // 304：數據沒有變化
+            if (response.status === 304) return { success: false };
+            apiETag = response.headers.get('ETag');
+            return response.json();
+        })
+        .then(applyDelta)
+        .then(renderData)
+        .catch(error => {
+            console.error('× 更新失敗:', error);
+        });
+}
+
+function renderData(data) {
+    if (data.success) {
+        if (data.aqi_data.has_data) {
+            Object.entries(MEASUREMENTS).forEach(([field, name]) => {
+                const level = data.aqi_data[`${field}_level`] || 0;
+                updateElement(`[data-${name}]`, formatValue(data.aqi_data[field]));
+                updateChange(`[data-${name}-change]`, formatChange(data.aqi_data[`${field}_change`]));
+                // 更新背景顏色與狀態標籤
+                updateCardColor(`[data-${name}]`, LEVEL_COLORS[level]);
+                updateStatus(`[data-${name}]`, LEVEL_LABELS[level]);
+            });
+        
+            updateElement('[data-publish-time]', formatTimestamp(data.aqi_data.publish_time));
+        }
+    
+        if (data.forecast_data.has_data) {
+            const forecast = data.forecast_data;
+            const forecastTime = formatTimestamp(forecast.forecast_time);
+            updateElement('[data-forecast-temp]', formatValue(forecast.temp));
+            updateElement('[data-forecast-feels]', formatValue(forecast.feels_like));
+            updateElement('[data-forecast-comfort]', formatValue(forecast.comfort_index));
+            updateElement('[data-forecast-comfort-desc]', forecast.comfort_desc || '無資料');
+            updateElement('[data-forecast-comfort-emoji]', comfortEmoji(forecast.comfort_desc));
+            updateElement('[data-forecast-humidity]', formatValue(forecast.humidity));
+            updateElement('[data-forecast-wind]', formatWind(forecast));
+            updateElement('[data-forecast-weather]', forecast.weather_desc || 'N/A');
+            updateElement('[data-forecast-pop]', formatValue(forecast.pop));
+            // MM/DD HH:MM
+            updateElement('[data-forecast-time]', `${forecastTime.slice(5, 7)}/${forecastTime.slice(8, 10)} ${forecastTime.slice(11, 16)}`);
+        }
+    
+        // 更新警特報（動態更新 DOM）
+        if (data.alert_data) {
+            const alertContainer = document.getElementById('alert-container');
+            if (alertContainer) {
+                if (data.alert_data.has_alert && data.alert_data.alerts.length > 0) {
+                    // 有警報：動態生成警報 HTML
+                    let alertsHTML = '';
+                    data.alert_data.alerts.forEach(alert => {
+                        alertsHTML += `
+                            <div class="weather-alert alert-${alert.color}">
+                                <div class="alert-icon">⚠️</div>
+                                <div class="alert-content">
+                                    <div class="alert-title">${alert.phenomena}${alert.significance}</div>
+                                    <div class="alert-time">生效時間：${alert.start_time} ~ ${alert.end_time}</div>
+                                </div>
+                            </div>
+                        `;
+                    });
+                    alertContainer.innerHTML = alertsHTML;
+                    alertContainer.style.display = 'block';
+                } else {
+                    // 無警報：清空並隱藏
+                    alertContainer.innerHTML = '';
+                    alertContainer.style.display = 'none';
+                }
+            }
+        }
+
+        updateElement('[data-page-time]', formatTaipeiNow());
+    
+        console.log('✓ 數據更新成功', new Date().toLocaleTimeString());
+    }
+}
+
+function updateElement(selector, value) {
+    const el = document.querySelector(selector);
+    if (el && value !== undefined && value !== null) {
+        el.textContent = value;
+    }
+}
+
+function updateChange(selector, value) {
+    const el = document.querySelector(selector);
+    if (el) {
+        if (value !== null && value !== undefined && value !== '') {
+            el.textContent = value;
+            el.style.display = '';
+            el.className = 'data-change';
+            if (value.includes('↑')) el.className += ' up';
+            else if (value.includes('↓')) el.className += ' down';
+            else el.className += ' same';
+        } else {
+            el.style.display = 'none';
+        }
+    }
+}
+
+// 新增函數：更新卡片背景顏色
+function updateCardColor(selector, colorClass) {
+    const el = document.querySelector(selector);
+    if (el) {
+        // 找到父層的 data-card
+        const card = el.closest('.data-card');
+        if (card) {
+            // 移除所有顏色 class
+            card.classList.remove('green', 'yellow', 'orange', 'red', 'gray');
+            // 加上新的顏色 class
+            if (colorClass) {
+                card.classList.add(colorClass);
+            }
+        }
+    }
+}
+
+// 新增函數：更新狀態標籤文字
+function updateStatus(selector, statusText) {
+    const el = document.querySelector(selector);
+    if (el) {
+        // 找到父層的 data-card
+        const card = el.closest('.data-card');
+        if (card) {
+            // 找到 .data-status 元素
+            const statusEl = card.querySelector('.data-status');
+            if (statusEl && statusText) {
+                statusEl.textContent = statusText;
+            }
+        }
+    }
+}
+
+// 優先使用伺服器推送(SSE)，快照一更新就收到；不支援時改回每3分鐘輪詢
+if (window.EventSource) {
+    const stream = new EventSource(apiUrl('/api/stream'));
+    stream.addEventListener('snapshot', event => {
+        renderData(applyDelta(JSON.parse(event.data)));
+    });
+} else {
+    setInterval(updateData, 180000);  // 每3分鐘更新一次
+    setTimeout(updateData, 10000);    // 10秒後首次自動更新
+}
+
+// 頁面為伺服器快取內容，載入時改顯示實際的頁面載入時間
+document.addEventListener('DOMContentLoaded', () => {
+    updateElement('[data-page-time]', formatTaipeiNow());
+});
@@ -0,0 +1,25 @@
+# 測試環境：不連線上游、不寫入共用快照與磁碟快照
+# app 匯入時會啟動背景更新執行緒，這裡讓所有上游請求立即失敗，並拉長重試間隔
+import os
+import sys
+import tempfile
+from unittest import mock
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['SHARED_STORE_PATH'] = ''
+os.environ['SNAPSHOT_FILE'] = ''
+os.environ['HISTORY_FILE'] = os.path.join(tempfile.mkdtemp(prefix='toufen-test-'), 'history.bin')
+os.environ['SOURCE_RETRY_SECONDS'] = '3600'
+mock.patch.object(requests.Session, 'get', side_effect=requests.ConnectionError('offline')).start()
+
+
+@pytest.fixture
+def app_module():
+    """持有 fetch_lock，測試期間背景更新不會執行"""
+    import app
+    with app.fetch_lock:
+        yield app
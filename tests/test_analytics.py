@@ -0,0 +1,108 @@
+import math
+
+import numpy as np
+import pytest
+
+from analytics import BREAKPOINTS, DECIMALS, OZONE_1H_BREAKPOINTS, SO2_24H_BREAKPOINTS, PollutantSeries, sub_index
+
+HOUR = 3600
+START = 1_700_000_000 - 1_700_000_000 % HOUR
+
+
+@pytest.mark.parametrize('table, decimals, concentration, expected', [
+    ('PM2.5', 1, 0.0, 0),
+    ('PM2.5', 1, 15.4, 50),
+    ('PM2.5', 1, 15.45, 50),
+    ('PM2.5', 1, 15.5, 51),
+    ('PM2.5', 1, 20.0, 62),
+    ('PM2.5', 1, 35.4, 100),
+    ('PM2.5', 1, 54.5, 151),
+    ('PM2.5', 1, 500.4, 500),
+    ('PM2.5', 1, 500.5, math.nan),
+    ('PM2.5', 1, -1.0, math.nan),
+    ('PM2.5', 1, math.nan, math.nan),
+    ('PM10', 0, 54, 50),
+    ('PM10', 0, 54.9, 50),
+    ('PM10', 0, 55, 51),
+    ('PM10', 0, 605, math.nan),
+    ('Ozone', 0, 55, 51),
+    ('Ozone', 0, 200, 300),
+    ('Ozone', 0, 201, math.nan),
+    ('CO', 1, 9.4, 100),
+    ('SO2', 0, 304, 200),
+    ('SO2', 0, 305, math.nan),
+    ('NO2', 0, 2049, 500),
+    ('NO2', 0, 2050, math.nan),
+    ('O3_1H', 0, 124, math.nan),
+    ('O3_1H', 0, 125, 101),
+    ('O3_1H', 0, 210, 203),
+    ('SO2_24H', 0, 304, math.nan),
+    ('SO2_24H', 0, 400, 232),
+])
+def test_sub_index(table, decimals, concentration, expected):
+    breakpoints = {'O3_1H': OZONE_1H_BREAKPOINTS, 'SO2_24H': SO2_24H_BREAKPOINTS}.get(table) or BREAKPOINTS[table]
+    result = sub_index([concentration], breakpoints, decimals)[0]
+    if math.isnan(expected):
+        assert math.isnan(result)
+    else:
+        assert result == expected
+
+
+def hourly_series(name, values):
+    series = PollutantSeries(name)
+    series.append(START + np.arange(len(values)) * HOUR, values)
+    return series
+
+
+def last(series, stat):
+    return series.stats[stat].view()[-1]
+
+
+@pytest.mark.parametrize('values, expected', [
+    # 前12小時平均 16.67、前4小時平均 30
+    ([10.0] * 8 + [30.0] * 4, 0.5 * (200 / 12) + 0.5 * 30),
+    # 前4小時有效筆數不足 2 筆時以前12小時平均代入
+    ([10.0] * 8 + [math.nan] * 3 + [30.0], 0.5 * 110 / 9 + 0.5 * 110 / 9),
+    # 前12小時有效筆數不足 6 筆時無法計算
+    ([math.nan] * 7 + [10.0] * 5, math.nan),
+])
+def test_moving_average(values, expected):
+    result = last(hourly_series('PM2.5', values), 'moving_avg')
+    if math.isnan(expected):
+        assert math.isnan(result)
+    else:
+        assert result == pytest.approx(expected)
+
+
+def test_ozone_8h_above_table_uses_hourly_table():
+    series = hourly_series('Ozone', [210.0] * 8)
+    assert last(series, 'mean_8h') == 210
+    assert last(series, 'sub_index') == 203
+
+
+def test_so2_above_hourly_table_uses_24h_mean():
+    assert last(hourly_series('SO2', [400.0] * 24), 'sub_index') == 232
+    # 24 小時平均的有效筆數不足時無定義
+    assert math.isnan(last(hourly_series('SO2', [400.0] * 10), 'sub_index'))
+    assert last(hourly_series('SO2', [20.0] * 10), 'sub_index') == 50
+
+
+@pytest.mark.parametrize('name', ['PM2.5', 'PM10', 'Ozone', 'CO', 'SO2', 'NO2'])
+def test_incremental_append_matches_single_append(name):
+    rng = np.random.default_rng(0)
+    values = rng.uniform(0, 150, 60).round(DECIMALS[name])
+    times = START + np.arange(60) * HOUR
+    # 中間缺一段小時
+    keep = np.ones(60, dtype=bool)
+    keep[20:25] = False
+    times, values = times[keep], values[keep]
+
+    whole = PollutantSeries(name)
+    whole.append(times, values)
+    incremental = PollutantSeries(name)
+    for chunk in np.array_split(np.arange(len(times)), [1, 10, 18, 40]):
+        incremental.append(times[chunk], values[chunk])
+
+    for stat, array in whole.stats.items():
+        np.testing.assert_allclose(incremental.stats[stat].view(), array.view(), equal_nan=True, err_msg=stat)
+    assert incremental.last_time == whole.last_time
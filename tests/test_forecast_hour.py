@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from forecast import build_columns
+
+
+def temperature_columns(start, hours):
+    return build_columns([{
+        'ElementName': '溫度',
+        'Time': [
+            {'DataTime': (start + timedelta(hours=h)).isoformat(), 'ElementValue': [{'Temperature': str(20 + h)}]}
+            for h in range(hours)
+        ],
+    }])
+
+
+def test_forecast_rolls_to_next_hour_without_upstream(app_module, monkeypatch):
+    app = app_module
+    start = datetime.fromtimestamp(app.next_forecast_hour(), app.TAIPEI_TZ)
+    timelines = {'頭份市': temperature_columns(start, 3)}
+    first = int(start.timestamp())
+    monkeypatch.setattr(app, 'next_forecast_hour', lambda: first)
+    app.publish_source('forecast', {
+        'locations': app.build_forecast_locations(timelines, first),
+        'timelines': timelines,
+        'last_fetch': app.get_taipei_time(),
+    })
+    app.forecast_hour = first
+    fetched_at = app.current_snapshot.fetched_at['forecast']
+    version = app.current_snapshot.version
+
+    # 同一小時內不重新發布
+    app.fetch_lock.release()
+    try:
+        app.roll_forecast_hour()
+        assert app.current_snapshot.version == version
+
+        monkeypatch.setattr(app, 'next_forecast_hour', lambda: first + 3600)
+        app.roll_forecast_hour()
+    finally:
+        app.fetch_lock.acquire()
+    snapshot = app.current_snapshot
+    assert snapshot.version == version + 1
+    assert snapshot.forecast['locations']['頭份市'].forecast_time == first + 3600
+    assert snapshot.forecast['locations']['頭份市'].temp == 21
+    assert snapshot.fetched_at['forecast'] == fetched_at
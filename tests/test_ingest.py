@@ -0,0 +1,112 @@
+import time
+from datetime import timedelta
+
+import pytest
+
+from history import HourlyHistory
+
+
+def hourly_records(hours, latest):
+    """頭份測站最近 hours 小時的 PM2.5 小時值，最新在前(上游預設排序)"""
+    return [
+        {
+            'sitename': 'Toufen',
+            'itemname': 'PM2.5',
+            'monitordate': (latest - timedelta(hours=h)).strftime('%Y-%m-%d %H:%M'),
+            'concentration': str(10 + h % 7),
+        }
+        for h in range(hours)
+    ]
+
+
+class NewestFirstUpstream:
+    """依 limit / offset 分頁回傳最新在前的紀錄"""
+
+    def __init__(self, records):
+        self.records = records
+        self.calls = 0
+
+    def __call__(self, url, **kwargs):
+        self.calls += 1
+        query = dict(part.split('=', 1) for part in url.split('?', 1)[1].split('&'))
+        limit, offset = int(query['limit']), int(query['offset'])
+        return 200, {'records': self.records[offset:offset + limit]}
+
+
+@pytest.fixture
+def ingest(app_module, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'hourly_history', HourlyHistory(str(tmp_path / 'history.bin')))
+    monkeypatch.setattr(app_module, 'HOURLY_PAGE_SIZE', 50)
+    latest = app_module.get_taipei_time().replace(minute=0, second=0, microsecond=0)
+    return app_module, latest
+
+
+def test_backfill_pages_newest_first(ingest, monkeypatch):
+    app, latest = ingest
+    upstream = NewestFirstUpstream(hourly_records(app.HOURLY_BACKFILL_HOURS, latest))
+    monkeypatch.setattr(app, 'fetch_upstream_json', upstream)
+
+    assert app.ingest_hourly_history() == app.HOURLY_BACKFILL_HOURS
+    assert upstream.calls == 4
+    times, _ = app.hourly_history.query('PM2.5', 0)
+    assert len(times) == app.HOURLY_BACKFILL_HOURS
+    assert list(times) == sorted(times)
+
+
+def test_failed_page_keeps_cursor(ingest, monkeypatch):
+    app, latest = ingest
+    upstream = NewestFirstUpstream(hourly_records(120, latest))
+
+    def failing(url, **kwargs):
+        if upstream.calls == 1:
+            raise app.requests.ConnectionError('timeout')
+        return upstream(url, **kwargs)
+
+    monkeypatch.setattr(app, 'fetch_upstream_json', failing)
+    # 第二頁失敗時已取得的較新分頁不寫入，下次仍從原游標補齊
+    assert app.ingest_hourly_history() == 0
+    assert app.hourly_history.latest_time() is None
+
+    upstream.calls = 0
+    monkeypatch.setattr(app, 'fetch_upstream_json', upstream)
+    assert app.ingest_hourly_history() == 120
+
+
+def test_realtime_published_before_backfill(ingest, monkeypatch):
+    app, latest = ingest
+    upstream = NewestFirstUpstream(hourly_records(120, latest))
+    record = {'sitename': app.DEFAULT_SITE, 'county': '苗栗縣', 'publishtime': latest.strftime('%Y-%m-%d %H:%M'), 'pm2.5': '15'}
+
+    def fetch(url, **kwargs):
+        if url.startswith(app.AQI_API_URL):
+            return 200, {'records': [record]}
+        # 即時數據發布前不回應小時值，等待回補的舊做法會在這裡逾時
+        deadline = time.monotonic() + 5
+        while app.DEFAULT_SITE not in app.current_snapshot.aqi['sites']:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        return upstream(url, **kwargs)
+
+    monkeypatch.setattr(app, 'fetch_upstream_json', fetch)
+    monkeypatch.setattr(app, 'current_snapshot', app.current_snapshot)
+    app.fetch_lock.release()
+    try:
+        app.refresh_data(['aqi'])
+    finally:
+        app.fetch_lock.acquire()
+    # 回補新增前一小時的資料後重新計算變化量
+    assert app.current_snapshot.aqi['sites'][app.DEFAULT_SITE].pm25_change == 15 - 11
+
+
+def test_empty_response_discards_batch(ingest, monkeypatch):
+    app, latest = ingest
+    upstream = NewestFirstUpstream(hourly_records(120, latest))
+
+    def no_content(url, **kwargs):
+        if upstream.calls == 1:
+            return 204, None
+        return upstream(url, **kwargs)
+
+    monkeypatch.setattr(app, 'fetch_upstream_json', no_content)
+    assert app.ingest_hourly_history() == 0
+    assert app.hourly_history.latest_time() is None
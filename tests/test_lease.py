@@ -0,0 +1,32 @@
+import sqlite3
+import time
+
+from history import HourlyHistory
+
+from test_ingest import NewestFirstUpstream, hourly_records
+
+
+def test_backfill_renews_lease(app_module, tmp_path, monkeypatch):
+    app = app_module
+    store = str(tmp_path / 'store.sqlite3')
+    monkeypatch.setattr(app, 'SHARED_STORE_PATH', store)
+    monkeypatch.setattr(app.store_local, 'conn', None, raising=False)
+    monkeypatch.setattr(app, 'REFRESHER_LEASE_SECONDS', 1)
+    monkeypatch.setattr(app, 'HOURLY_PAGE_SIZE', 10)
+    monkeypatch.setattr(app, 'hourly_history', HourlyHistory(str(tmp_path / 'history.bin')))
+    latest = app.get_taipei_time().replace(minute=0, second=0, microsecond=0)
+    upstream = NewestFirstUpstream(hourly_records(40, latest))
+    expiries = []
+
+    def slow_upstream(url, **kwargs):
+        # 回補總耗時超過租約時間，每頁開始時租約都必須仍在有效期內
+        row = sqlite3.connect(store).execute('SELECT owner, expires_at FROM refresher_lease').fetchone()
+        expiries.append(row[1] - time.time())
+        assert row[0] == app.WORKER_ID
+        time.sleep(0.4)
+        return upstream(url, **kwargs)
+
+    monkeypatch.setattr(app, 'fetch_upstream_json', slow_upstream)
+    assert app.ingest_hourly_history() == 40
+    assert len(expiries) == 5
+    assert min(expiries) > 0.5
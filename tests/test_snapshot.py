@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+
+def alert_source(app, phenomena='大雨'):
+    return {
+        'has_alert': True,
+        'alerts': [{'phenomena': phenomena, 'significance': '特報', 'start_time': '', 'end_time': '', 'color': 'yellow'}],
+        'last_fetch': app.get_taipei_time(),
+    }
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def test_identical_refresh_keeps_version(app_module):
+    app = app_module
+    app.publish_source('alert', alert_source(app))
+    before = app.current_snapshot
+    time.sleep(0.01)
+    app.publish_source('alert', alert_source(app))
+    after = app.current_snapshot
+    assert after.version == before.version
+    assert after.source_versions == before.source_versions
+    assert after.fetched_at['alert'] > before.fetched_at['alert']
+    # 內容沒變時保留原本的數據(含 last_fetch)，API 內容與 ETag 不變
+    assert after.alert is before.alert
+
+    app.publish_source('alert', alert_source(app, '豪雨'))
+    assert app.current_snapshot.version == before.version + 1
+
+
+def test_identical_refresh_returns_304(app_module, client):
+    app = app_module
+    app.publish_source('alert', alert_source(app))
+    etag = client.get('/api/data').headers['ETag']
+    app.publish_source('alert', alert_source(app))
+    assert client.get('/api/data', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_identical_site_readings_ignore_update_time(app_module):
+    app = app_module
+    record = {'sitename': '頭份', 'county': '苗栗縣', 'aqi': '40', 'pm2.5': '10', 'publishtime': '2026/10/17 20:00:00'}
+
+    def aqi_source(fetch_time):
+        site = app.build_site_data(record, None, fetch_time)
+        return {'sites': {'頭份': site}, 'counties': {'苗栗縣': ['頭份']}, 'last_fetch': fetch_time}
+
+    app.publish_source('aqi', aqi_source(app.get_taipei_time()))
+    version = app.current_snapshot.version
+    time.sleep(1.1)
+    app.publish_source('aqi', aqi_source(app.get_taipei_time()))
+    assert app.current_snapshot.version == version
+
+
+def test_unknown_view_before_first_fetch(app_module, client, monkeypatch):
+    app = app_module
+    empty = app.replace(
+        app.current_snapshot,
+        aqi=app.freeze(app.EMPTY_AQI_SOURCE),
+        forecast=app.freeze(app.EMPTY_FORECAST_SOURCE),
+        fetched_at=app.MappingProxyType(dict.fromkeys(app.current_snapshot.fetched_at)),
+    )
+    monkeypatch.setattr(app, 'current_snapshot', empty)
+    # 尚未抓到數據時無法判斷測站與鄉鎮是否存在，顯示暫無資料而不是 404
+    assert client.get('/site/竹南').status_code == 200
+    assert client.get('/api/data?location=竹南鎮').status_code == 200
+
+    fetch_time = app.get_taipei_time()
+    app.publish_source('aqi', {'sites': {}, 'counties': {}, 'last_fetch': fetch_time})
+    assert client.get('/site/竹南').status_code == 404
+    assert client.get('/api/data?location=竹南鎮').status_code == 200
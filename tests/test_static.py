@@ -0,0 +1,22 @@
+import pytest
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def test_previous_release_asset_serves_current(app_module, client):
+    current = client.get(app_module.STATIC_URLS['app.js'])
+    assert 'immutable' in current.headers['Cache-Control']
+
+    # 上一版頁面引用的舊雜湊網址改送目前版本，且不可永久快取
+    previous = client.get('/static/app.0123456789.js')
+    assert previous.status_code == 200
+    assert previous.data == current.data
+    assert previous.headers['Cache-Control'] == 'no-cache'
+
+
+@pytest.mark.parametrize('name', ['app.js', 'missing.0123456789.js', 'app.0123456789.css'])
+def test_unknown_asset_is_404(client, name):
+    assert client.get(f'/static/{name}').status_code == 404